@@ -0,0 +1,241 @@
+from datetime import datetime, timezone
+import threading
+import shutil
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from .schema import PlayerStats
+
+# Per-game stats of every player, stored as NumPy arrays which each API
+# process memory-maps, so all gunicorn workers share one copy in the page
+# cache. The store is rebuilt by the ingest scripts into a new directory and
+# swapped in by replacing a pointer file naming it, so readers never see a
+# partial build:
+#   <path>/CURRENT             the name of the current version's directory
+#   <path>/<version>/
+#       meta.json              stats, and each block's row ranges
+#       game_values.npy        int16 (games, stats)
+#       game_player_ids.npy    int32 (games,)
+#       game_match_ids.npy     int32 (games,)
+#       player_ids.npy         int32 (players,)
+#       player_games.npy       int16 (players,)
+#       player_averages.npy    float32 (players, stats), per game
+#       sorted_averages.npy    float32 (players, stats), each column sorted
+#                              within each block
+# Rows are grouped into blocks by season and position group (with every
+# player of a season also in that season's 'all' block), and sorted by player
+# ID within each block, so a block is a contiguous slice of each array
+DEFAULT_ANALYTICS_DIR = 'analytics'
+STATS = ['kicks', 'handballs', 'disposals', 'marks', 'goals', 'behinds',
+    'tackles', 'hitouts', 'frees_for', 'frees_against']
+POSITION_GROUPS = {
+    'defenders': ['BPL', 'FB', 'BPR', 'HBFL', 'CHB', 'HBFR'],
+    'midfielders': ['WL', 'C', 'WR', 'R', 'RR'],
+    'forwards': ['HFFL', 'CHF', 'HFFR', 'FPL', 'FF', 'FPR'],
+    'rucks': ['RK'],
+}
+GROUPS = ['all', *POSITION_GROUPS]
+POSITION_TO_GROUP = {position: group
+    for group, positions in POSITION_GROUPS.items() for position in positions}
+# Number of previous builds kept, for readers which still have them mapped
+KEEP_VERSIONS = 2
+
+def analytics_dir(path=None):
+    return path or os.getenv('API_ANALYTICS_DIR', DEFAULT_ANALYTICS_DIR)
+
+def block_key(season, group):
+    return f'{season}/{group}'
+
+def build_stat_cube(session, path=None):
+    # Build the store from player_stats. Each player's position group in a
+    # season is the one they were most often selected in, ignoring the bench
+    path = analytics_dir(path)
+    columns = [col for col in STATS if col != 'disposals']
+    rows = session.query(PlayerStats.season, PlayerStats.player_id,
+            PlayerStats.match_id, PlayerStats.position,
+            *[getattr(PlayerStats, col) for col in columns])\
+        .order_by(PlayerStats.season, PlayerStats.player_id, PlayerStats.match_id)\
+        .all()
+    games = pd.DataFrame(rows, columns=['season', 'player_id', 'match_id',
+        'position', *columns])
+    games[columns] = games[columns].fillna(0)
+    games['disposals'] = games['kicks'] + games['handballs']
+    groups = games.assign(group=games['position'].map(POSITION_TO_GROUP))\
+        .dropna(subset=['group'])\
+        .groupby(['season', 'player_id', 'group']).size()\
+        .rename('selections').reset_index()\
+        .sort_values('selections', ascending=False, kind='stable')\
+        .drop_duplicates(['season', 'player_id'])\
+        .set_index(['season', 'player_id'])['group']
+    games = games.join(groups, on=['season', 'player_id'])
+    players = games.groupby(['season', 'player_id'])\
+        .agg(games=('match_id', 'size'), group=('group', 'first'),
+            **{col: (col, 'mean') for col in STATS})\
+        .reset_index()
+
+    game_blocks = []
+    player_blocks = []
+    sorted_blocks = []
+    blocks = {}
+    game_start = player_start = 0
+    for season in sorted(players['season'].unique()):
+        season_games = games[games['season'] == season]
+        season_players = players[players['season'] == season]
+        for group in GROUPS:
+            if group == 'all':
+                block_games, block_players = season_games, season_players
+            else:
+                block_games = season_games[season_games['group'] == group]
+                block_players = season_players[season_players['group'] == group]
+            if block_players.empty:
+                continue
+            averages = block_players[STATS].to_numpy(np.float32)
+            game_blocks.append(block_games)
+            player_blocks.append(block_players)
+            sorted_blocks.append(np.sort(averages, axis=0))
+            blocks[block_key(season, group)] = [player_start,
+                player_start + len(block_players), game_start,
+                game_start + len(block_games)]
+            player_start += len(block_players)
+            game_start += len(block_games)
+    if not blocks:
+        return None
+    games = pd.concat(game_blocks)
+    players = pd.concat(player_blocks)
+    int16 = np.iinfo(np.int16)
+    arrays = {
+        'game_values': games[STATS].clip(int16.min, int16.max).to_numpy(np.int16),
+        'game_player_ids': games['player_id'].to_numpy(np.int32),
+        'game_match_ids': games['match_id'].to_numpy(np.int32),
+        'player_ids': players['player_id'].to_numpy(np.int32),
+        'player_games': players['games'].clip(upper=int16.max).to_numpy(np.int16),
+        'player_averages': players[STATS].to_numpy(np.float32),
+        'sorted_averages': np.concatenate(sorted_blocks),
+    }
+    version = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+    version_path = os.path.join(path, version)
+    os.makedirs(version_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(version_path, f'{name}.npy'), array)
+    with open(os.path.join(version_path, 'meta.json'), 'w') as f:
+        json.dump({'stats': STATS, 'blocks': blocks}, f)
+    # Swap the new build in atomically, then remove old builds
+    pointer_path = os.path.join(path, 'CURRENT')
+    temp_pointer_path = f'{pointer_path}.{os.getpid()}.tmp'
+    with open(temp_pointer_path, 'w') as f:
+        f.write(version)
+    os.replace(temp_pointer_path, pointer_path)
+    versions = sorted(x for x in os.listdir(path) if x.isdigit())
+    for old_version in versions[:-(KEEP_VERSIONS + 1)]:
+        shutil.rmtree(os.path.join(path, old_version), ignore_errors=True)
+    return version
+
+class StatCube:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.version = None
+        self.data = None
+
+    def get(self):
+        # The current build, mapped afresh whenever a new one is swapped in.
+        # Raises FileNotFoundError if none has been built
+        path = analytics_dir(self.path)
+        with open(os.path.join(path, 'CURRENT')) as f:
+            version = f.read().strip()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    version_path = os.path.join(path, version)
+                    with open(os.path.join(version_path, 'meta.json')) as f:
+                        meta = json.load(f)
+                    arrays = {name[:-4]: np.load(os.path.join(version_path, name),
+                            mmap_mode='r')
+                        for name in os.listdir(version_path) if name.endswith('.npy')}
+                    self.data = meta, arrays
+                    self.version = version
+        return self.data
+
+    def block(self, season, group):
+        meta, arrays = self.get()
+        rows = meta['blocks'].get(block_key(season, group))
+        if rows is None:
+            raise KeyError(block_key(season, group))
+        return meta, arrays, rows
+
+    def player_group(self, player_id, season):
+        # The position group of a player in a season, or None if they have
+        # none (e.g. were always on the bench)
+        for group in POSITION_GROUPS:
+            try:
+                self.player_row(player_id, season, group)
+                return group
+            except KeyError:
+                continue
+        return None
+
+    def player_row(self, player_id, season, group):
+        meta, arrays, (start, end, _, _) = self.block(season, group)
+        player_ids = arrays['player_ids'][start:end]
+        i = np.searchsorted(player_ids, player_id)
+        if i == len(player_ids) or player_ids[i] != player_id:
+            raise KeyError(player_id)
+        return start + int(i)
+
+    def percentiles(self, player_id, season, group=None):
+        # A player's per game average of each stat, its percentile (the
+        # percentage of players in the group with a lower average, counting
+        # ties as half) and its rank (1 for the highest) within the group
+        if group is None:
+            group = self.player_group(player_id, season) or 'all'
+        meta, arrays, (start, end, _, _) = self.block(season, group)
+        row = self.player_row(player_id, season, group)
+        values = arrays['player_averages'][row]
+        sorted_values = arrays['sorted_averages'][start:end]
+        count = end - start
+        below = np.array([np.searchsorted(sorted_values[:, j], values[j], 'left')
+            for j in range(len(meta['stats']))])
+        not_above = np.array([np.searchsorted(sorted_values[:, j], values[j], 'right')
+            for j in range(len(meta['stats']))])
+        percentiles = 100 * (below + (not_above - below) / 2) / count
+        ranks = count - not_above + 1
+        return {
+            'player_id': int(player_id),
+            'season': int(season),
+            'position': group,
+            'games': int(arrays['player_games'][row]),
+            'count': int(count),
+            'stats': {stat: {
+                'value': float(values[j]),
+                'percentile': float(percentiles[j]),
+                'rank': int(ranks[j]),
+            } for j, stat in enumerate(meta['stats'])},
+        }
+
+    def histogram(self, season, stat, group='all', bins=20, per='player'):
+        # Distribution of a stat in a group, over players' per game averages
+        # or over individual games
+        meta, arrays, (start, end, game_start, game_end) = self.block(season, group)
+        j = meta['stats'].index(stat)
+        if per == 'game':
+            values = arrays['game_values'][game_start:game_end, j]
+            # Integer stats get a bin per value where there are few enough
+            if values.size and values.max() - values.min() < bins:
+                bins = np.arange(values.min(), values.max() + 2) - 0.5
+        else:
+            values = arrays['player_averages'][start:end, j]
+        counts, edges = np.histogram(values, bins=bins)
+        return {
+            'season': int(season),
+            'stat': stat,
+            'position': group,
+            'per': per,
+            'count': int(values.size),
+            'mean': float(values.mean()) if values.size else None,
+            'counts': counts.tolist(),
+            'edges': edges.tolist(),
+        }
+
+stat_cube = StatCube()
@@ -1,25 +1,186 @@
 from flask_smorest import Blueprint, abort
-from sqlalchemy import desc, text, or_, and_
-from sqlalchemy.orm import Session
+from sqlalchemy import desc, text, or_, and_, bindparam
+from sqlalchemy.orm import Session, selectinload, joinedload
 from sqlalchemy.sql.expression import func
-from marshmallow import Schema
-from marshmallow.fields import Nested, List, Float as MFloat, Integer as MInteger
+from marshmallow import Schema, EXCLUDE
+from marshmallow.fields import Nested, List, Dict, Float as MFloat, Integer as MInteger, \
+    String as MString, Boolean as MBoolean, Raw
+from marshmallow.validate import Length, Range, OneOf
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from urllib.parse import unquote
+import binascii
+import base64
+import json
+import threading
+import random
+import time
+import os
 
 from .db import engine
 from .schema import *
+from .cache import cached, mark_immutable, on_invalidate, ValueCache
+from .search import player_search_index
+from .analytics import stat_cube, STATS as ANALYTICS_STATS, GROUPS as ANALYTICS_GROUPS
+from .encoders import RowEncoder, ColumnEncoder, encode_json, json_response
 
 def pp_to_limit_offset(pagination_parameters):
     limit = pagination_parameters.page_size
     offset = (pagination_parameters.page - 1) * limit
     return limit, offset
 
+def encode_cursor(direction, value):
+    return base64.urlsafe_b64encode(json.dumps([direction, value]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        direction, value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, message='Invalid cursor')
+    if direction not in ('after', 'before') or not isinstance(value, int):
+        abort(400, message='Invalid cursor')
+    return direction, value
+
+# Total counts for paginated endpoints, which only change as matches are ingested
+count_cache = ValueCache()
+on_invalidate(count_cache.invalidate)
+
+def paginate_by_key(query, key, get_key, pagination_parameters, position,
+        include_count, count_key):
+    # Pages are ordered by key descending. With a decoded cursor (as returned
+    # in the X-Next-Cursor and X-Prev-Cursor headers of a previous page), the
+    # page is found by seeking on the key rather than with an offset;
+    # otherwise the page number is used. Total counts are cached, and can be
+    # skipped
+    limit, offset = pp_to_limit_offset(pagination_parameters)
+    if include_count:
+        pagination_parameters.item_count = count_cache.get_or_set(count_key,
+            query.enable_eagerloads(False).count)
+    if position is None:
+        results = query.order_by(desc(key)).limit(limit + 1).offset(offset).all()
+        has_next = len(results) > limit
+        has_prev = offset > 0
+        results = results[:limit]
+    else:
+        direction, value = position
+        if direction == 'after':
+            results = query.where(key < value)\
+                .order_by(desc(key)).limit(limit + 1).all()
+            has_next = len(results) > limit
+            has_prev = True
+            results = results[:limit]
+        else:
+            results = query.where(key > value)\
+                .order_by(key).limit(limit + 1).all()
+            has_next = True
+            has_prev = len(results) > limit
+            results = results[:limit][::-1]
+    headers = {}
+    if results and has_next:
+        headers['X-Next-Cursor'] = encode_cursor('after', get_key(results[-1]))
+    if results and has_prev:
+        headers['X-Prev-Cursor'] = encode_cursor('before', get_key(results[0]))
+    return results, headers
+
+class CursorArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    cursor = MString(load_default=None)
+    include_count = MBoolean(load_default=True)
+
+# The current season and round (and latest ladder round) are shared by all
+# requests in a process, and refreshed after a short TTL or when the ingest
+# scripts announce new data
+CURRENT_ROUND_TTL_SECONDS = int(os.getenv('API_CURRENT_ROUND_TTL', 30))
+class CurrentRoundState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self, scope=None):
+        with self.lock:
+            self.current_round = None
+            self.max_ladder_rounds = {}
+            self.expires = 0
+
+    def get(self, session):
+        with self.lock:
+            if self.current_round is None or time.monotonic() > self.expires:
+                latest_match = session.query(Matches.round, Matches.season)\
+                    .order_by(desc(Matches.season), desc(Matches.round))\
+                    .limit(1).one()
+                self.current_round = latest_match.round, latest_match.season
+                self.max_ladder_rounds = {}
+                self.expires = time.monotonic() + CURRENT_ROUND_TTL_SECONDS
+            return self.current_round
+
+    def get_max_ladder_round(self, session, season):
+        self.get(session)
+        with self.lock:
+            if season not in self.max_ladder_rounds:
+                self.max_ladder_rounds[season] = session.query(func.max(Ladder.round))\
+                    .where(Ladder.season == season)\
+                    .one()[0]
+            return self.max_ladder_rounds[season]
+
+current_round_state = CurrentRoundState()
+on_invalidate(current_round_state.invalidate)
+
+on_invalidate(player_search_index.invalidate)
+
 def get_current_round(session):
-    latest_match = session.query(Matches)\
-        .order_by(desc(Matches.season), desc(Matches.round))\
-        .limit(1).one()
-    return latest_match.round, latest_match.season
+    return current_round_state.get(session)
+
+def query_match_with_player_stats(session, match_id):
+    # Load a match with its player stats and their players in two queries
+    # (the match, then the stats joined to players), rather than lazily
+    # loading the stats and then each player while serialising. Every column
+    # of the three tables is serialised, so whole entities are loaded (see
+    # tests/test_match_loading.py for the query count)
+    return session.query(Matches)\
+        .options(selectinload(Matches.player_stats)\
+            .joinedload(PlayerStats.player, innerjoin=True))\
+        .where(Matches.id == match_id)\
+        .one()
+
+# IDs of the current season's players, for picking a random player in
+# constant time. Refreshed when the current round changes or new players are
+# announced
+class RandomPlayerPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current_round = None
+        self.player_ids = []
+
+    def invalidate(self, scope=None):
+        if scope in (None, 'players', 'all'):
+            with self.lock:
+                self.current_round = None
+
+    def get(self, session):
+        current_round = get_current_round(session)
+        with self.lock:
+            if self.current_round != current_round:
+                round, season = current_round
+                # Ordered so that seeded choices agree across processes
+                self.player_ids = [x[0] for x in session.query(PlayersBySeason.id)\
+                    .where(PlayersBySeason.season == season)\
+                    .distinct()\
+                    .order_by(PlayersBySeason.id)\
+                    .all()]
+                self.current_round = current_round
+            return self.player_ids
+
+random_player_pool = RandomPlayerPool()
+on_invalidate(random_player_pool.invalidate)
+
+# Encoded career stats of players picked at random
+career_stats_cache = ValueCache()
+on_invalidate(career_stats_cache.invalidate)
+
+def is_past_round(session, season, round):
+    # Matches and ladders for rounds before the current one no longer change
+    current_round, current_season = get_current_round(session)
+    return (int(season), int(round)) < (current_season, current_round)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -84,17 +245,133 @@ class DataSpanSchema(Schema):
     min_round = MInteger()
     max_round = MInteger()
 
+MAX_COMPARE_PLAYERS = 10
+class CompareArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    player_id = List(MInteger(), required=True,
+        validate=Length(min=1, max=MAX_COMPARE_PLAYERS))
+    # Whether to include every game, which is most of the response
+    games = MBoolean(load_default=True)
+
+# A player's stats in a match along with the match's details
+class GameLogSchema(Schema):
+    player_id = MInteger()
+    match_id = MInteger()
+    season = MInteger()
+    round = MInteger()
+    team = MString()
+    position = MString()
+    kicks = MInteger()
+    handballs = MInteger()
+    marks = MInteger()
+    goals = MInteger()
+    behinds = MInteger()
+    tackles = MInteger()
+    hitouts = MInteger()
+    frees_for = MInteger()
+    frees_against = MInteger()
+    subbed_on = MBoolean()
+    subbed_off = MBoolean()
+    home_team = MString()
+    away_team = MString()
+    home_score = MInteger()
+    away_score = MInteger()
+
+class LeadersArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    # Players tied at the last rank are all included
+    limit = MInteger(load_default=10, validate=Range(min=1, max=LEADERBOARD_SIZE))
+
+class LeaderSchema(Schema):
+    rank = MInteger()
+    player_id = MInteger()
+    name = MString()
+    team = MString()
+    value = MInteger()
+
+class RoundLeaderSchema(LeaderSchema):
+    match_id = MInteger()
+
+class PercentilesArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    # Defaults to the player's own position group
+    position = MString(load_default=None, validate=OneOf(ANALYTICS_GROUPS))
+
+class StatPercentileSchema(Schema):
+    value = MFloat()
+    percentile = MFloat()
+    rank = MInteger()
+
+class PercentilesSchema(Schema):
+    player_id = MInteger()
+    season = MInteger()
+    position = MString()
+    games = MInteger()
+    count = MInteger()
+    stats = Dict(keys=MString(), values=Nested(StatPercentileSchema))
+
+class HistogramArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    position = MString(load_default='all', validate=OneOf(ANALYTICS_GROUPS))
+    bins = MInteger(load_default=20, validate=Range(min=1, max=100))
+    # Over players' per game averages or over individual games
+    per = MString(load_default='player', validate=OneOf(['player', 'game']))
+
+class HistogramSchema(Schema):
+    season = MInteger()
+    stat = MString()
+    position = MString()
+    per = MString()
+    count = MInteger()
+    mean = MFloat(allow_none=True)
+    counts = List(MInteger())
+    edges = List(MFloat())
+
+# max-age of a seeded random player, which stays the same until the pool changes
+RANDOM_PLAYER_MAX_AGE = int(os.getenv('API_RANDOM_PLAYER_MAX_AGE', 300))
+class RandomPlayerArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    # The same player for the same seed, or for everyone within an hour
+    seed = MInteger(load_default=None)
+    mode = MString(load_default='random', validate=OneOf(['random', 'hourly']))
+
+# Each field of PlayerSeasonStatsSchema and GameLogSchema respectively, mapped
+# to a list of its values in every row
+class ComparisonSchema(Schema):
+    seasons = Dict(keys=MString(), values=List(Raw()))
+    games = Dict(keys=MString(), values=List(Raw()))
+
+# Precompiled encoders producing the same output as each schema
+player_encoder = RowEncoder(PlayerSchema())
+player_mapping_encoder = RowEncoder(PlayerSchema(), mapping=True)
+player_season_stats_encoder = RowEncoder(PlayerSeasonStatsSchema())
+matches_encoder = RowEncoder(MatchesSchema())
+matches_with_player_stats_encoder = RowEncoder(MatchesWithPlayerStatsSchema())
+player_stats_with_match_encoder = RowEncoder(PlayerStatsWithMatchSchema())
+ladder_encoder = RowEncoder(LadderSchema())
+data_span_encoder = RowEncoder(DataSpanSchema())
+leader_encoder = RowEncoder(LeaderSchema())
+round_leader_encoder = RowEncoder(RoundLeaderSchema())
+player_season_stats_column_encoder = ColumnEncoder(PlayerSeasonStatsSchema())
+game_log_column_encoder = ColumnEncoder(GameLogSchema())
+
 @api_bp.route('/match/<match_id>')
+@cached
 @api_bp.response(200, MatchesWithPlayerStatsSchema)
 def match(match_id):
     with Session(engine) as session:
         try:
-            result = session.query(Matches)\
-                .where(Matches.id == match_id)\
-                .one()
+            result = query_match_with_player_stats(session, match_id)
         except Exception:
             abort(404)
-        return MatchesWithPlayerStatsSchema().dump(result)
+        if not result.live:
+            mark_immutable()
+        return matches_with_player_stats_encoder.response(result, many=False)
 
 @api_bp.route('/player/<player_id>')
 @api_bp.response(200, PlayerSeasonStatsSchema(many=True))
@@ -111,8 +388,7 @@ def player(player_id):
             results = session.execute(sql, {'player_id': player_id})
         except Exception:
             abort(404)
-        schema = PlayerSeasonStatsSchema()
-        return [schema.dump(x) for x in results]
+        return player_season_stats_encoder.response(results)
 
 @api_bp.route('/players/<search_str>')
 @api_bp.paginate(max_page_size=50)
@@ -122,36 +398,31 @@ def search_players(search_str, pagination_parameters):
     search_str = unquote(search_str)
     with Session(engine) as session:
         try:
-            subquery = session.query(PlayersBySeason.name, PlayersBySeason.id,
-                    func.max(PlayersBySeason.season).label('season'))\
-                .where(PlayersBySeason.name.ilike(f'%{search_str}%'))\
-                .group_by(PlayersBySeason.name, PlayersBySeason.id)\
-                .subquery()
-            query = session.query(subquery, PlayersBySeason.team, PlayersBySeason.jumper_number)\
-                .join(PlayersBySeason, and_(
-                        PlayersBySeason.season == subquery.c.season,
-                        PlayersBySeason.id == subquery.c.id,
-                    ))\
-                .order_by(PlayersBySeason.team)
-            pagination_parameters.item_count = query.count()
-            results = query.limit(limit).offset(offset).all()
+            results = player_search_index.search(session, search_str)
         except Exception:
             abort(404)
-        schema = PlayerSchema()
-        return [schema.dump(x) for x in results]
+        pagination_parameters.item_count = len(results)
+        return player_mapping_encoder.response(results[offset:offset + limit])
 
 @api_bp.route('/random_player')
+@api_bp.arguments(RandomPlayerArgsSchema, location='query', as_kwargs=True)
 @api_bp.response(200, PlayerSeasonStatsSchema(many=True))
-def random_player():
+def random_player(seed, mode):
+    # Seeded and hourly players can be cached by clients and proxies until
+    # they could change
     with Session(engine) as session:
         try:
-            # Extract the ID of a random current player
-            round, season = get_current_round(session)
-            subquery = session.query(PlayersBySeason)\
-                .distinct(PlayersBySeason.id)\
-                .where(PlayersBySeason.season == season)\
-                .subquery()
-            result = session.query(subquery).order_by(func.random()).limit(1).one()
+            player_ids = random_player_pool.get(session)
+            if mode == 'hourly':
+                now = int(time.time())
+                player_id = random.Random(now // 3600).choice(player_ids)
+                headers = {'Cache-Control': f'public, max-age={3600 - now % 3600}'}
+            elif seed is not None:
+                player_id = random.Random(seed).choice(player_ids)
+                headers = {'Cache-Control': f'public, max-age={RANDOM_PLAYER_MAX_AGE}'}
+            else:
+                player_id = random.choice(player_ids)
+                headers = {'Cache-Control': 'no-store'}
             sql = text('''
                 SELECT * FROM players_by_season pbs
                 JOIN player_season_stats pss
@@ -159,11 +430,12 @@ def random_player():
                 WHERE pbs.id = :player_id
                 ORDER BY pbs.season DESC
             ''')
-            results = session.execute(sql, {'player_id': result.id})
+            body = career_stats_cache.get_or_set(player_id,
+                lambda: player_season_stats_encoder.encode(
+                    session.execute(sql, {'player_id': player_id})))
         except Exception:
             abort(404)
-        schema = PlayerSeasonStatsSchema()
-        return [schema.dump(x) for x in results]
+        return json_response(body, headers)
 
 @api_bp.route('/players_by_team/<team_name>')
 @api_bp.response(200, PlayerSchema(many=True))
@@ -180,8 +452,7 @@ def players_by_team(team_name):
                 .all()
         except Exception:
             abort(404)
-        schema = PlayerSchema()
-        return [schema.dump(x) for x in results]
+        return player_encoder.response(results)
 
 @api_bp.route('/current_matches')
 @api_bp.response(200, MatchesSchema(many=True))
@@ -195,10 +466,10 @@ def current_matches():
                 .all()
         except Exception:
             abort(404)
-        schema = MatchesSchema()
-        return [schema.dump(x) for x in results]
+        return matches_encoder.response(results)
 
 @api_bp.route('/matches_by_round/<season>/<round>')
+@cached
 @api_bp.response(200, MatchesSchema(many=True))
 def matches_by_round(season, round):
     with Session(engine) as session:
@@ -207,46 +478,49 @@ def matches_by_round(season, round):
                 .where(Matches.season == season, Matches.round == round)\
                 .order_by(Matches.id)\
                 .all()
+            if is_past_round(session, season, round):
+                mark_immutable()
         except Exception:
             abort(404)
-        schema = MatchesSchema()
-        return [schema.dump(x) for x in results]
+        return matches_encoder.response(results)
 
 @api_bp.route('/matches_by_team/<team_name>')
+@api_bp.arguments(CursorArgsSchema, location='query', as_kwargs=True)
 @api_bp.paginate(max_page_size=50)
 @api_bp.response(200, MatchesSchema(many=True))
-def matches_by_team(team_name, pagination_parameters):
+def matches_by_team(team_name, pagination_parameters, cursor, include_count):
     team_name = unquote(team_name)
-    limit, offset = pp_to_limit_offset(pagination_parameters)
+    position = decode_cursor(cursor) if cursor else None
     with Session(engine) as session:
         try:
             query = session.query(Matches)\
                 .where(or_(Matches.home_team == team_name,
-                    Matches.away_team == team_name))\
-                .order_by(desc(Matches.id))
-            pagination_parameters.item_count = query.count()
-            results = query.limit(limit).offset(offset).all()
+                    Matches.away_team == team_name))
+            results, headers = paginate_by_key(query, Matches.id, lambda x: x.id,
+                pagination_parameters, position, include_count,
+                ('matches_by_team', team_name))
         except Exception:
             abort(404)
-        schema = MatchesSchema()
-        return [schema.dump(x) for x in results]
+        return matches_encoder.response(results, headers=headers)
 
 @api_bp.route('/stats_by_player/<player_id>')
+@api_bp.arguments(CursorArgsSchema, location='query', as_kwargs=True)
 @api_bp.paginate(max_page_size=50)
 @api_bp.response(200, PlayerStatsWithMatchSchema(many=True))
-def stats_by_player(player_id, pagination_parameters):
-    limit, offset = pp_to_limit_offset(pagination_parameters)
+def stats_by_player(player_id, pagination_parameters, cursor, include_count):
+    position = decode_cursor(cursor) if cursor else None
     with Session(engine) as session:
         try:
             query = session.query(PlayerStats)\
-                .where(PlayerStats.player_id == player_id)\
-                .order_by(desc(PlayerStats.match_id))
-            pagination_parameters.item_count = query.count()
-            results = query.limit(limit).offset(offset).all()
+                .options(joinedload(PlayerStats.match),
+                    joinedload(PlayerStats.player, innerjoin=True))\
+                .where(PlayerStats.player_id == player_id)
+            results, headers = paginate_by_key(query, PlayerStats.match_id,
+                lambda x: x.match_id, pagination_parameters, position,
+                include_count, ('stats_by_player', player_id))
         except Exception:
             abort(404)
-        schema = PlayerStatsWithMatchSchema()
-        return [schema.dump(x) for x in results]
+        return player_stats_with_match_encoder.response(results, headers=headers)
 
 @api_bp.route('/current_ladder')
 @api_bp.response(200, LadderSchema(many=True))
@@ -255,19 +529,17 @@ def current_ladder():
         try:
             round, season = get_current_round(session)
             # If current round is a finals round, get the last home and away round
-            max_round = session.query(func.max(Ladder.round))\
-                .where(Ladder.season == season)\
-                .one()[0]
+            max_round = current_round_state.get_max_ladder_round(session, season)
             results = session.query(Ladder)\
                 .where(Ladder.season == season, Ladder.round == min(round, max_round))\
                 .order_by(desc(Ladder.ladder_points), desc(Ladder.percent))\
                 .all()
         except Exception:
             abort(404)
-        schema = LadderSchema()
-        return [schema.dump(x) for x in results]
+        return ladder_encoder.response(results)
 
 @api_bp.route('/ladder_by_round/<season>/<round>')
+@cached
 @api_bp.response(200, LadderSchema(many=True))
 def ladder_by_round(season, round):
     with Session(engine) as session:
@@ -276,12 +548,14 @@ def ladder_by_round(season, round):
                 .where(Ladder.season == season, Ladder.round == round)\
                 .order_by(desc(Ladder.ladder_points), desc(Ladder.percent))\
                 .all()
+            if is_past_round(session, season, round):
+                mark_immutable()
         except Exception:
             abort(404)
-        schema = LadderSchema()
-        return [schema.dump(x) for x in results]
+        return ladder_encoder.response(results)
 
 @api_bp.route('/data_span')
+@cached
 @api_bp.response(200, DataSpanSchema(many=True)) 
 def data_span():
     with Session(engine) as session:
@@ -294,4 +568,117 @@ def data_span():
                 .all()
         except Exception:
             abort(404)
-        return [DataSpanSchema().dump(x) for x in results]
\ No newline at end of file
+        return data_span_encoder.response(results)
+
+@api_bp.route('/compare')
+@cached
+@api_bp.arguments(CompareArgsSchema, location='query', as_kwargs=True)
+@api_bp.response(200, ComparisonSchema)
+def compare(player_id, games):
+    # Season totals and (unless games is false) every game of up to
+    # MAX_COMPARE_PLAYERS players, in two queries, ordered by player then
+    # most recent first
+    player_ids = list(dict.fromkeys(player_id))
+    with Session(engine) as session:
+        try:
+            sql = text('''
+                SELECT * FROM players_by_season pbs
+                JOIN player_season_stats pss
+                ON pbs.id = pss.player_id AND pbs.season = pss.season
+                WHERE pbs.id IN :player_ids
+                ORDER BY pbs.id, pbs.season DESC
+            ''').bindparams(bindparam('player_ids', expanding=True))
+            seasons = session.execute(sql, {'player_ids': player_ids})
+            body = {'seasons': player_season_stats_column_encoder.columns(seasons)}
+            if games:
+                game_log = session.query(PlayerStats.player_id, PlayerStats.match_id,
+                        PlayerStats.season, Matches.round, PlayersBySeason.team,
+                        PlayerStats.position, PlayerStats.kicks, PlayerStats.handballs,
+                        PlayerStats.marks, PlayerStats.goals, PlayerStats.behinds,
+                        PlayerStats.tackles, PlayerStats.hitouts, PlayerStats.frees_for,
+                        PlayerStats.frees_against, PlayerStats.subbed_on,
+                        PlayerStats.subbed_off, Matches.home_team, Matches.away_team,
+                        Matches.home_score.label('home_score'),
+                        Matches.away_score.label('away_score'))\
+                    .join(Matches, Matches.id == PlayerStats.match_id)\
+                    .join(PlayersBySeason, and_(PlayersBySeason.id == PlayerStats.player_id,
+                        PlayersBySeason.season == PlayerStats.season))\
+                    .where(PlayerStats.player_id.in_(player_ids))\
+                    .order_by(PlayerStats.player_id, desc(PlayerStats.match_id))\
+                    .all()
+                body['games'] = game_log_column_encoder.columns(game_log)
+        except Exception:
+            abort(404)
+        return json_response(encode_json(body))
+
+@api_bp.route('/leaders/<season>/<stat>')
+@cached
+@api_bp.arguments(LeadersArgsSchema, location='query', as_kwargs=True)
+@api_bp.response(200, LeaderSchema(many=True))
+def season_leaders(season, stat, limit):
+    if stat not in LEADER_STATS:
+        abort(404)
+    with Session(engine) as session:
+        try:
+            results = session.query(SeasonLeaders.rank, SeasonLeaders.player_id,
+                    SeasonLeaders.value, PlayersBySeason.name, PlayersBySeason.team)\
+                .join(PlayersBySeason, and_(PlayersBySeason.id == SeasonLeaders.player_id,
+                    PlayersBySeason.season == SeasonLeaders.season))\
+                .where(SeasonLeaders.season == season, SeasonLeaders.stat == stat,
+                    SeasonLeaders.rank <= limit)\
+                .order_by(SeasonLeaders.rank, PlayersBySeason.name)\
+                .all()
+            round, current_season = get_current_round(session)
+            if int(season) < current_season:
+                mark_immutable()
+        except Exception:
+            abort(404)
+        return leader_encoder.response(results)
+
+@api_bp.route('/leaders/<season>/<round>/<stat>')
+@cached
+@api_bp.arguments(LeadersArgsSchema, location='query', as_kwargs=True)
+@api_bp.response(200, RoundLeaderSchema(many=True))
+def round_leaders(season, round, stat, limit):
+    if stat not in LEADER_STATS:
+        abort(404)
+    with Session(engine) as session:
+        try:
+            results = session.query(RoundLeaders.rank, RoundLeaders.player_id,
+                    RoundLeaders.match_id, RoundLeaders.value, PlayersBySeason.name,
+                    PlayersBySeason.team)\
+                .join(PlayersBySeason, and_(PlayersBySeason.id == RoundLeaders.player_id,
+                    PlayersBySeason.season == RoundLeaders.season))\
+                .where(RoundLeaders.season == season, RoundLeaders.round == round,
+                    RoundLeaders.stat == stat, RoundLeaders.rank <= limit)\
+                .order_by(RoundLeaders.rank, PlayersBySeason.name)\
+                .all()
+            if is_past_round(session, season, round):
+                mark_immutable()
+        except Exception:
+            abort(404)
+        return round_leader_encoder.response(results)
+
+# Answered from the memory-mapped stat store (see analytics.py), which is
+# quick enough not to need caching and so always reflects the latest build
+@api_bp.route('/percentiles/<player_id>/<season>')
+@api_bp.arguments(PercentilesArgsSchema, location='query', as_kwargs=True)
+@api_bp.response(200, PercentilesSchema)
+def percentiles(player_id, season, position):
+    try:
+        result = stat_cube.percentiles(int(player_id), int(season), position)
+    except Exception:
+        abort(404)
+    return json_response(encode_json(result))
+
+@api_bp.route('/histogram/<season>/<stat>')
+@api_bp.arguments(HistogramArgsSchema, location='query', as_kwargs=True)
+@api_bp.response(200, HistogramSchema)
+def histogram(season, stat, position, bins, per):
+    if stat not in ANALYTICS_STATS:
+        abort(404)
+    try:
+        result = stat_cube.histogram(int(season), stat, position, bins, per)
+    except Exception:
+        abort(404)
+    return json_response(encode_json(result))
@@ -1,7 +1,9 @@
 from flask import Flask, send_from_directory
 from dotenv import load_dotenv
+import os
 
 from .api import api_bp
+from .cache import start_invalidation_listener
 
 load_dotenv()
 static_path = '../static'
@@ -29,7 +31,8 @@ def create_app():
     def home_other(path):
         return send_from_directory(templates_path, 'index.html')
 
-    # Serve API endpoints
+    # Serve API endpoints, dropping cached responses when data is ingested
     app.register_blueprint(api_bp)
+    start_invalidation_listener(os.getenv('DATABASE_URI'))
     
     return app
@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, g
+from sqlalchemy import text
+import psycopg2
+import psycopg2.extensions
+import threading
+import hashlib
+import select
+import time
+import os
+
+# Channel on which the ingest scripts announce that cached responses are out
+# of date. Payloads are 'live' (drop responses which may change while a
+# season is in progress), 'players' (new players have been added, which is
+# also a live change) or 'all'
+CACHE_INVALIDATION_CHANNEL = 'api_cache'
+MAX_ENTRIES = int(os.getenv('API_CACHE_MAX_ENTRIES', 1024))
+# Upper bound on staleness of live responses if an invalidation is missed
+LIVE_TTL_SECONDS = int(os.getenv('API_CACHE_LIVE_TTL', 60))
+
+class CachedResponse:
+    def __init__(self, response, immutable):
+        self.body = response.get_data()
+        self.headers = [(k, v) for k, v in response.headers
+            if k.lower() not in ('content-length', 'etag', 'cache-control')]
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.immutable = immutable
+        self.expires = None if immutable else time.monotonic() + LIVE_TTL_SECONDS
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() > self.expires
+
+    def to_response(self):
+        response = make_response(self.body, 200, self.headers)
+        response.set_etag(self.etag)
+        response.cache_control.public = True
+        if self.immutable:
+            response.cache_control.max_age = 86400
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+# Size-bounded LRU cache of encoded responses, shared by all requests in a
+# worker process
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expired():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, scope='live'):
+        with self.lock:
+            if scope == 'all':
+                self.entries.clear()
+                return
+            for key in [k for k, v in self.entries.items() if not v.immutable]:
+                del self.entries[key]
+
+response_cache = ResponseCache()
+
+# Size-bounded LRU cache of arbitrary values which may change while a season
+# is in progress, so are dropped on any invalidation or after a TTL
+class ValueCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_seconds=LIVE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_or_set(self, key, func):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self.entries.move_to_end(key)
+                return entry[0]
+        value = func()
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, scope=None):
+        with self.lock:
+            self.entries.clear()
+
+# Called with the scope of each invalidation announced by the ingest scripts
+INVALIDATION_CALLBACKS = [response_cache.invalidate]
+def on_invalidate(callback):
+    INVALIDATION_CALLBACKS.append(callback)
+    return callback
+
+def invalidate(scope='live'):
+    for callback in INVALIDATION_CALLBACKS:
+        callback(scope)
+
+def mark_immutable():
+    # Called from a view whose response can never change (e.g. a completed
+    # match) so that it is cached indefinitely
+    g.cache_immutable = True
+
+def cached(func):
+    # Cache a view's encoded response per route and parameters. Must be
+    # applied outside the flask-smorest response and pagination decorators
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (request.endpoint, request.full_path)
+        entry = response_cache.get(key)
+        if entry is None:
+            g.cache_immutable = False
+            response = make_response(func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = CachedResponse(response, g.cache_immutable)
+            response_cache.set(key, entry)
+        return entry.to_response()
+    return wrapper
+
+def notify_cache_invalidation(session, scope='live'):
+    # Sent when the session's transaction commits
+    session.execute(text('SELECT pg_notify(:channel, :payload)'),
+        {'channel': CACHE_INVALIDATION_CHANNEL, 'payload': scope})
+
+def listen_for_invalidations(dsn):
+    while True:
+        connection = None
+        try:
+            connection = psycopg2.connect(dsn)
+            connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CACHE_INVALIDATION_CHANNEL};')
+            # Anything could have changed while not listening
+            invalidate('all')
+            while True:
+                select.select([connection], [], [], 60)
+                connection.poll()
+                while connection.notifies:
+                    invalidate(connection.notifies.pop(0).payload)
+        except psycopg2.Error:
+            if connection is not None:
+                connection.close()
+            time.sleep(5)
+
+def start_invalidation_listener(database_uri):
+    dsn = database_uri.replace('postgresql+psycopg2://', 'postgresql://')
+    thread = threading.Thread(target=listen_for_invalidations, args=(dsn,),
+        daemon=True)
+    thread.start()
+    return thread
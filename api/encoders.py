@@ -0,0 +1,85 @@
+from flask import Response
+from marshmallow import fields
+import json
+
+# Conversions applied by marshmallow when dumping each field type
+CONVERTERS = [
+    (fields.Integer, 'int'),
+    (fields.Float, 'float'),
+    (fields.Boolean, 'bool'),
+    (fields.String, 'str'),
+]
+
+def compile_encoder(schema, mapping=False, columns=False):
+    # Generate a function converting a row (an ORM object or Row, or a dict if
+    # mapping is True) into the same dict as schema.dump, without running
+    # marshmallow's per-field machinery. Keys are sorted as Flask would. With
+    # columns, the function returns a tuple of the values in key order and
+    # has the keys as its keys attribute
+    namespace = {}
+    items = []
+    dump_fields = sorted(schema.dump_fields.items(),
+        key=lambda x: x[1].data_key or x[0])
+    for i, (name, field) in enumerate(dump_fields):
+        key = field.data_key or name
+        attribute = field.attribute or name
+        value = f'obj[{attribute!r}]' if mapping else f'obj.{attribute}'
+        if isinstance(field, fields.Nested):
+            namespace[f'nested_{i}'] = compile_encoder(field.schema)
+            expr = f'None if (v := {value}) is None else nested_{i}(v)'
+        elif isinstance(field, fields.List) and \
+                isinstance(field.inner, fields.Nested):
+            namespace[f'nested_{i}'] = compile_encoder(field.inner.schema)
+            expr = f'None if (v := {value}) is None else [nested_{i}(x) for x in v]'
+        else:
+            converter = next((c for t, c in CONVERTERS if isinstance(field, t)),
+                None)
+            expr = value if converter is None else \
+                f'None if (v := {value}) is None else {converter}(v)'
+        items.append((key, expr))
+    if columns:
+        values = ', '.join(f'({expr})' for _, expr in items)
+        source = f'def encode(obj):\n    return ({values},)\n'
+    else:
+        values = ', '.join(f'{key!r}: ({expr})' for key, expr in items)
+        source = 'def encode(obj):\n    return {' + values + '}\n'
+    exec(source, namespace)
+    encode = namespace['encode']
+    encode.keys = [key for key, _ in items]
+    return encode
+
+def encode_json(data):
+    # Matches Flask's JSON responses
+    return (json.dumps(data, separators=(',', ':')) + '\n').encode()
+
+def json_response(body, headers=None):
+    return Response(body, mimetype='application/json', headers=headers)
+
+# Encodes rows straight to JSON bytes in the shape of a marshmallow schema, for
+# views to return as a response (which flask-smorest passes through unchanged,
+# while still documenting the schema)
+class RowEncoder:
+    def __init__(self, schema, mapping=False):
+        self.encode_row = compile_encoder(schema, mapping)
+
+    def encode(self, data, many=True):
+        if many:
+            data = [self.encode_row(x) for x in data]
+        else:
+            data = self.encode_row(data)
+        return encode_json(data)
+
+    def response(self, data, many=True, headers=None):
+        return json_response(self.encode(data, many), headers)
+
+# Encodes rows column-wise, as a dict of each field's name to a list of its
+# values in every row, which is much smaller than a list of row objects when
+# there are many rows
+class ColumnEncoder:
+    def __init__(self, schema, mapping=False):
+        self.encode_row = compile_encoder(schema, mapping, columns=True)
+
+    def columns(self, data):
+        values = list(zip(*map(self.encode_row, data))) or \
+            [()] * len(self.encode_row.keys)
+        return {key: list(x) for key, x in zip(self.encode_row.keys, values)}
@@ -1,4 +1,5 @@
-from sqlalchemy import ForeignKey, String, Integer, Boolean, ForeignKeyConstraint
+from sqlalchemy import ForeignKey, String, Integer, Boolean, ForeignKeyConstraint, Index, \
+    DateTime, func
 from sqlalchemy.orm import DeclarativeBase, mapped_column, relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -25,8 +26,15 @@ class Matches(Base):
     live = mapped_column(Boolean)
     time = mapped_column(String(10))
     percent_complete = mapped_column(Integer)
+    # Incremented by the live ingester on every change
+    version = mapped_column(Integer, server_default='0')
 
     player_stats = relationship('PlayerStats', backref='match')
+    __table_args__ = (
+        Index('matches_season_round_idx', season, round),
+        Index('matches_home_team_id_idx', home_team, id),
+        Index('matches_away_team_id_idx', away_team, id),
+    )
     
     @hybrid_property
     def home_score(self):
@@ -48,6 +56,11 @@ class PlayersBySeason(Base):
     team = mapped_column(String(30), ForeignKey('teams.name'))
     jumper_number = mapped_column(Integer)
 
+    __table_args__ = (
+        Index('players_by_season_season_team_jumper_number_idx', season, team,
+            jumper_number),
+    )
+
 class Ladder(Base):
     __tablename__ = 'ladder'
     team = mapped_column(String(30), ForeignKey('teams.name'), primary_key=True)
@@ -59,6 +72,10 @@ class Ladder(Base):
     points_for = mapped_column(Integer)
     points_against = mapped_column(Integer)
 
+    __table_args__ = (
+        Index('ladder_season_round_idx', season, round),
+    )
+
     @hybrid_property
     def ladder_points(self):
         return 4 * self.wins + 2 * self.draws
@@ -92,8 +109,84 @@ class PlayerStats(Base):
         ForeignKeyConstraint(
             [player_id, season], [PlayersBySeason.id, PlayersBySeason.season]
         ),
+        # Also serves ORDER BY match_id DESC with a backward scan
+        Index('player_stats_player_id_match_id_idx', player_id, match_id),
     )
     
     @hybrid_property
     def disposals(self):
-        return self.kicks + self.handballs
\ No newline at end of file
+        return self.kicks + self.handballs
+
+# Per-season totals maintained incrementally from player_stats by the ingest
+# scripts (see update_player_season_stats in ingest_historical.py)
+class PlayerSeasonStats(Base):
+    __tablename__ = 'player_season_stats'
+    player_id = mapped_column(Integer, primary_key=True)
+    season = mapped_column(Integer, primary_key=True)
+    games = mapped_column(Integer)
+    kicks = mapped_column(Integer)
+    handballs = mapped_column(Integer)
+    marks = mapped_column(Integer)
+    goals = mapped_column(Integer)
+    behinds = mapped_column(Integer)
+    tackles = mapped_column(Integer)
+    hitouts = mapped_column(Integer)
+    frees_for = mapped_column(Integer)
+    frees_against = mapped_column(Integer)
+
+# Progress of ingest_historical.py through each season, so an interrupted run
+# resumes after the last committed match rather than from the season's start
+class IngestCheckpoints(Base):
+    __tablename__ = 'ingest_checkpoints'
+    season = mapped_column(Integer, primary_key=True)
+    last_match_id = mapped_column(Integer)
+    # 'in_progress' or 'complete'
+    status = mapped_column(String(20))
+    updated_at = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+# Stats with leaderboards, mapped to the columns of player_stats or
+# player_season_stats which are summed for their value
+LEADER_STATS = {
+    'goals': ['goals'],
+    'behinds': ['behinds'],
+    'disposals': ['kicks', 'handballs'],
+    'kicks': ['kicks'],
+    'handballs': ['handballs'],
+    'marks': ['marks'],
+    'tackles': ['tackles'],
+    'hitouts': ['hitouts'],
+    'frees_for': ['frees_for'],
+    'frees_against': ['frees_against'],
+}
+LEADERBOARD_SIZE = 25
+
+# Top players for each stat in a season (from player_season_stats) and in a
+# round (from player_stats), ranked with ties sharing a rank, so all players
+# tied at the last rank are kept. Maintained by the ingest scripts (see
+# update_round_leaders and update_season_leaders in ingest_historical.py)
+class SeasonLeaders(Base):
+    __tablename__ = 'season_leaders'
+    season = mapped_column(Integer, primary_key=True)
+    stat = mapped_column(String(20), primary_key=True)
+    player_id = mapped_column(Integer, primary_key=True)
+    rank = mapped_column(Integer)
+    value = mapped_column(Integer)
+
+    __table_args__ = (
+        Index('season_leaders_season_stat_rank_idx', season, stat, rank),
+    )
+
+class RoundLeaders(Base):
+    __tablename__ = 'round_leaders'
+    season = mapped_column(Integer, primary_key=True)
+    round = mapped_column(Integer, primary_key=True)
+    stat = mapped_column(String(20), primary_key=True)
+    player_id = mapped_column(Integer, primary_key=True)
+    match_id = mapped_column(Integer)
+    rank = mapped_column(Integer)
+    value = mapped_column(Integer)
+
+    __table_args__ = (
+        Index('round_leaders_season_round_stat_rank_idx', season, round, stat,
+            rank),
+    )
@@ -0,0 +1,84 @@
+from sqlalchemy import and_, func
+import threading
+import time
+import os
+
+from .schema import PlayersBySeason
+
+# Rebuilt at least this often even if no change to players is announced
+REBUILD_SECONDS = int(os.getenv('API_SEARCH_REBUILD_SECONDS', 3600))
+WORD_SEPARATORS = '. -\''
+
+def trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+# In-memory index of each player's identity (their latest season under each
+# name) for type-ahead search. Names are indexed by trigram, so a search only
+# checks the names sharing every trigram of the search string
+class PlayerSearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (players, names, index), replaced as a whole
+        self.data = None
+        self.expires = 0
+
+    def invalidate(self, scope=None):
+        if scope in (None, 'players', 'all'):
+            self.expires = 0
+
+    def build(self, session):
+        subquery = session.query(PlayersBySeason.name, PlayersBySeason.id,
+                func.max(PlayersBySeason.season).label('season'))\
+            .group_by(PlayersBySeason.name, PlayersBySeason.id)\
+            .subquery()
+        results = session.query(subquery, PlayersBySeason.team,
+                PlayersBySeason.jumper_number)\
+            .join(PlayersBySeason, and_(
+                    PlayersBySeason.season == subquery.c.season,
+                    PlayersBySeason.id == subquery.c.id,
+                ))\
+            .order_by(PlayersBySeason.team, subquery.c.name)\
+            .all()
+        players = [x._asdict() for x in results]
+        names = [(x['name'] or '').lower() for x in players]
+        index = {}
+        for i, name in enumerate(names):
+            for trigram in trigrams(name):
+                index.setdefault(trigram, []).append(i)
+        # Swap in the new index as a whole so concurrent searches are unaffected
+        self.data = players, names, index
+
+    def ensure_built(self, session):
+        if self.data is not None and time.monotonic() < self.expires:
+            return
+        with self.lock:
+            if self.data is None or time.monotonic() >= self.expires:
+                self.expires = time.monotonic() + REBUILD_SECONDS
+                self.build(session)
+
+    def rank(self, name, search_str):
+        # Matches at the start of the name rank first, then at the start of a
+        # word (e.g. a surname after an initial), then anywhere
+        position = name.find(search_str)
+        if position == 0:
+            return 0
+        if name[position - 1] in WORD_SEPARATORS:
+            return 1
+        return 2
+
+    def search(self, session, search_str):
+        self.ensure_built(session)
+        players, names, index = self.data
+        search_str = search_str.lower()
+        search_trigrams = trigrams(search_str)
+        if search_trigrams:
+            postings = sorted((index.get(x, []) for x in search_trigrams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            candidates = range(len(names))
+        # Players are stored in team and name order, so ties keep that order
+        matches = sorted((i for i in candidates if search_str in names[i]),
+            key=lambda i: (self.rank(names[i], search_str), i))
+        return [players[i] for i in matches]
+
+player_search_index = PlayerSearchIndex()
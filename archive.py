@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+import threading
+import hashlib
+import gzip
+import json
+import os
+
+# Raw match XML as fetched from DTLive, stored once per distinct document
+# (named by the SHA-256 of its content) and gzipped:
+#   <path>/objects/ab/cdef....xml.gz
+#   <path>/index.jsonl
+# Each line of the index records a fetch of a match: its ID, season, fetch
+# time and the digest of the document. Only fetches which changed the
+# document are recorded, so the last line for a match is its latest version
+DEFAULT_ARCHIVE_DIR = 'xml_archive'
+COMPRESS_LEVEL = 6
+
+class XmlArchive:
+    def __init__(self, path=None):
+        self.path = path or os.getenv('XML_ARCHIVE_DIR', DEFAULT_ARCHIVE_DIR)
+        self.index_path = os.path.join(self.path, 'index.jsonl')
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], f'{digest[2:]}.xml.gz')
+
+    def load_index(self):
+        # Match ID -> fetches of that match in the order recorded
+        if self.entries is None:
+            self.entries = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self.entries.setdefault(entry['match_id'], [])\
+                                .append(entry)
+        return self.entries
+
+    def put(self, match_id, content, season=None, fetched_at=None):
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            history = self.load_index().get(match_id)
+            if history and history[-1]['digest'] == digest:
+                return digest
+            path = self.object_path(digest)
+            if not os.path.exists(path):
+                # Write then rename so a crash never leaves a partial object
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(gzip.compress(content, COMPRESS_LEVEL))
+                os.replace(temp_path, path)
+            entry = {
+                'match_id': match_id,
+                'season': int(season) if season is not None else None,
+                'fetched_at': (fetched_at or datetime.now(timezone.utc)).isoformat(),
+                'digest': digest,
+                'size': len(content),
+            }
+            # The object is written before the index line which refers to it
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.entries.setdefault(match_id, []).append(entry)
+        return digest
+
+    def get(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def latest(self, match_id):
+        # The index entry for the latest version of a match
+        history = self.load_index().get(match_id)
+        return history[-1] if history else None
+
+    def match_ids(self):
+        # IDs of archived matches, in order
+        return sorted(self.load_index())
+
+    def read_matches(self, match_ids):
+        # Yields (match ID, XML content) for each given match in the archive
+        for match_id in match_ids:
+            entry = self.latest(match_id)
+            if entry is not None:
+                yield match_id, self.get(entry['digest'])
@@ -0,0 +1,86 @@
+# Requests each API endpoint, capturing the SQL it issues, then runs EXPLAIN
+# ANALYZE on each statement and fails if any reads one of the large tables
+# with a sequential scan. Run from the repository root against a database
+# populated with real or synthetic data (see benchmarks/synthetic.py), e.g.
+#   python -m benchmarks.synthetic --seasons 10 --reset
+#   python -m benchmarks.explain_check
+import json
+import click
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from api.app import create_app
+from api.db import engine
+from benchmarks.synthetic import api_urls
+
+LARGE_TABLES = {'matches', 'player_stats', 'players_by_season', 'ladder',
+    'player_season_stats'}
+# Sequential scans of small tables (or of few rows) are cheaper than an index
+# scan, so only fail above this many rows
+MIN_ROWS = 1000
+# Endpoints which read whole tables by design: data_span aggregates every
+# match and the player search index is built from all players
+EXEMPT = {'data_span', 'search_players'}
+
+class StatementRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+def seq_scans(plan):
+    if plan['Node Type'] == 'Seq Scan':
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+def explain(statement, parameters):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {statement}', parameters)
+        plan = cursor.fetchone()[0]
+        # Undo any writes (there should be none) made by ANALYZE
+        connection.rollback()
+    finally:
+        connection.close()
+    return plan[0]
+
+@click.command()
+@click.option('--min_rows', default=MIN_ROWS, type=click.INT)
+@click.option('--verbose', is_flag=True, help='Print every plan')
+def main(min_rows, verbose):
+    client = create_app().test_client()
+    with Session(engine) as session:
+        urls = api_urls(session)
+    failures = []
+    for name, url in urls:
+        recorder = StatementRecorder()
+        event.listen(engine, 'before_cursor_execute', recorder)
+        try:
+            status = client.get(url).status_code
+        finally:
+            event.remove(engine, 'before_cursor_execute', recorder)
+        print(f'{url}: {status}, {len(recorder.statements)} queries')
+        for statement, parameters in recorder.statements:
+            plan = explain(statement, parameters)
+            if verbose:
+                print(statement)
+                print(json.dumps(plan['Plan'], indent=2))
+            for node in seq_scans(plan['Plan']):
+                rows = max(node['Plan Rows'], node.get('Actual Rows', 0))
+                if node['Relation Name'] in LARGE_TABLES and rows >= min_rows:
+                    message = f'{name}: sequential scan of {node["Relation Name"]}' \
+                        f' ({rows} rows) in\n{statement}'
+                    if name in EXEMPT:
+                        print(f'Ignoring {message}')
+                    else:
+                        failures.append(message)
+    for message in failures:
+        print(f'FAIL {message}')
+    assert not failures, f'{len(failures)} sequential scans of large tables'
+
+if __name__ == '__main__':
+    main()
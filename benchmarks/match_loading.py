@@ -0,0 +1,74 @@
+# Compares queries and latency of loading and serialising a match for
+# /api/match/<id> lazily versus with query_match_with_player_stats, and fails
+# if the latter issues more than MAX_QUERIES queries (which
+# tests/test_match_loading.py also checks, without a database server). Run
+# from the repository root against a populated database:
+#   python -m benchmarks.match_loading --iterations 200
+import json
+import time
+import click
+import numpy as np
+from sqlalchemy import event, desc
+from sqlalchemy.orm import Session
+
+from api.db import engine
+from api.schema import Matches
+from api.api import MatchesWithPlayerStatsSchema, query_match_with_player_stats
+
+# The match, then its player stats joined to their players
+MAX_QUERIES = 2
+
+def load_lazily(session, match_id):
+    return session.query(Matches).where(Matches.id == match_id).one()
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+def measure(loader, match_id, iterations):
+    schema = MatchesWithPlayerStatsSchema()
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        timings = []
+        for _ in range(iterations):
+            counter.count = 0
+            start = time.perf_counter()
+            # A new session each time, as in the endpoint
+            with Session(engine) as session:
+                schema.dump(loader(session, match_id))
+            timings.append(1000 * (time.perf_counter() - start))
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+    timings = np.array(timings)
+    return {
+        'queries': counter.count,
+        'latency_ms': {
+            'p50': float(np.percentile(timings, 50)),
+            'p90': float(np.percentile(timings, 90)),
+            'p99': float(np.percentile(timings, 99)),
+        },
+    }
+
+@click.command()
+@click.option('--match_id', default=None, type=click.INT)
+@click.option('--iterations', default=100, type=click.INT)
+def main(match_id, iterations):
+    if match_id is None:
+        with Session(engine) as session:
+            match_id = session.query(Matches.id)\
+                .order_by(desc(Matches.id)).limit(1).one()[0]
+    results = {
+        'match_id': match_id,
+        'lazy': measure(load_lazily, match_id, iterations),
+        'eager': measure(query_match_with_player_stats, match_id, iterations),
+    }
+    print(json.dumps(results, indent=2))
+    assert results['eager']['queries'] <= MAX_QUERIES, \
+        f'Loading match {match_id} took {results["eager"]["queries"]} queries'
+
+if __name__ == '__main__':
+    main()
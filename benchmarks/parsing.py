@@ -0,0 +1,143 @@
+# Compares the per-match cost of parsing DTLive match XML with the previous
+# ElementTree parser (decoding and re-encoding the response text, then
+# building dicts per player) against parse_match_columns in
+# ingest_historical.py, checking both give the same rows. Parses a directory
+# of saved XML files (named <match ID>.xml) or, without one, synthetic matches
+# so no database is needed:
+#   python -m benchmarks.parsing --xml_dir saved_xml
+#   python -m benchmarks.parsing --matches 500
+import json
+import os
+import random
+import time
+import click
+import numpy as np
+from pathlib import Path
+from xml.etree import ElementTree
+from lxml.etree import XMLParser
+
+# The ingest script creates an engine on import but never connects here
+os.environ.setdefault('DATABASE_URI', 'postgresql://localhost/site_db')
+
+from benchmarks.synthetic import new_squads, generate_season, match_xml
+from ingest_historical import MATCH_PROPERTIES_MAP, PLAYER_PROPERTIES_MAP, \
+    MatchBatch, parse_match_columns
+
+def parse_match_data_tree(match_number, content):
+    # The parser before parse_match_columns, for comparison
+    content = content.decode('utf-8').encode('utf-8')
+    root = ElementTree.fromstring(content,
+        parser=XMLParser(encoding='utf-8', recover=True))
+    match_stats = {'id': match_number}
+    player_stats = []
+    player_season_stats = []
+    for child in root:
+        if child.tag == 'Game':
+            for property in child:
+                if property.tag in MATCH_PROPERTIES_MAP:
+                    key = MATCH_PROPERTIES_MAP[property.tag]
+                    match_stats[key] = property.text
+                    if (key == 'home_team' or key == 'away_team') and \
+                            property.text == 'GWS Giants':
+                        match_stats[key] = 'Greater Western Sydney'
+        elif child.tag in ['Home', 'Away']:
+            for player in child:
+                _player_stats = {
+                    'match_id': match_number,
+                    'season': match_stats['season'],
+                    'subbed_on': False,
+                    'subbed_off': False,
+                }
+                _player_season_stats = {'season': match_stats['season']}
+                for property in player:
+                    if property.tag in PLAYER_PROPERTIES_MAP:
+                        key = PLAYER_PROPERTIES_MAP[property.tag]
+                        _player_stats[key] = property.text
+                        if key == 'position' and property.text and \
+                                property.text.startswith('INT'):
+                            _player_stats[key] = 'INT'
+                    if property.tag == 'IconImage':
+                        if property.text == 'greenvest.png':
+                            _player_stats['subbed_on'] = True
+                        elif property.text == 'redvest.png':
+                            _player_stats['subbed_off'] = True
+                    if property.tag == 'Name':
+                        _player_season_stats['name'] = property.text
+                    if property.tag == 'PlayerID':
+                        _player_season_stats['id'] = property.text
+                    if property.tag == 'JumperNumber':
+                        _player_season_stats['jumper_number'] = property.text
+                    _player_season_stats['team'] = match_stats['home_team'] \
+                        if child.tag == 'Home' else match_stats['away_team']
+                player_stats.append(_player_stats)
+                player_season_stats.append(_player_season_stats)
+    return match_stats, player_stats, player_season_stats
+
+def load_corpus(xml_dir):
+    return [(int(path.stem), path.read_bytes())
+        for path in sorted(Path(xml_dir).glob('*.xml')) if path.stem.isdigit()]
+
+def synthetic_corpus(num_matches, seed):
+    rng = random.Random(seed)
+    squads, next_player_id = new_squads(rng, 1)
+    matches, players, player_stats, _, _ = generate_season(rng, 2024, squads,
+        next_player_id, 1)
+    players_by_id = {x['id']: x for x in players}
+    stats_by_match = {}
+    for row in player_stats:
+        stats_by_match.setdefault(row['match_id'], []).append(row)
+    return [(match['id'], match_xml(match, players_by_id, stats_by_match[match['id']]))
+        for match in (matches * (num_matches // len(matches) + 1))[:num_matches]]
+
+def without_missing(rows):
+    # parse_match_columns gives None for properties missing from the XML,
+    # where the previous parser left the key out
+    return [{k: v for k, v in row.items() if v is not None} for row in rows]
+
+def measure(parse, corpus, iterations):
+    timings = []
+    for _ in range(iterations):
+        for match_id, content in corpus:
+            start = time.perf_counter()
+            parse(match_id, content)
+            timings.append(1000000 * (time.perf_counter() - start))
+    timings = np.array(timings)
+    return {
+        'matches_per_second': 1000000 / timings.mean(),
+        'per_match_us': {
+            'p50': float(np.percentile(timings, 50)),
+            'p90': float(np.percentile(timings, 90)),
+            'p99': float(np.percentile(timings, 99)),
+        },
+    }
+
+@click.command()
+@click.option('--xml_dir', default=None, type=click.Path(exists=True, file_okay=False))
+@click.option('--matches', default=200, type=click.INT,
+    help='Number of synthetic matches without --xml_dir')
+@click.option('--iterations', default=5, type=click.INT)
+@click.option('--seed', default=0, type=click.INT)
+def main(xml_dir, matches, iterations, seed):
+    corpus = load_corpus(xml_dir) if xml_dir else synthetic_corpus(matches, seed)
+    assert corpus, f'No match XML files in {xml_dir}'
+    for match_id, content in corpus:
+        expected = parse_match_data_tree(match_id, content)
+        match_stats, player_stats, player_season_stats = \
+            parse_match_columns(match_id, content).records()
+        assert without_missing(match_stats) == [expected[0]], match_id
+        assert without_missing(player_stats) == expected[1], match_id
+        assert without_missing(player_season_stats) == expected[2], match_id
+    # Parsing into one batch for a whole season, as ingest_historical.py does
+    batch = MatchBatch()
+    results = {
+        'matches': len(corpus),
+        'bytes_per_match': sum(len(x) for _, x in corpus) / len(corpus),
+        'element_tree': measure(parse_match_data_tree, corpus, iterations),
+        'columns': measure(parse_match_columns, corpus, iterations),
+        'columns_batch': measure(lambda match_id, content:
+            parse_match_columns(match_id, content, batch), corpus, iterations),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Compares serialising each endpoint's response with marshmallow (then
+# encoding to JSON as Flask would) against the precompiled encoders in
+# api/encoders.py, checking the output is identical. Uses synthetic rows so
+# no database is needed:
+#   python -m benchmarks.serialization --rows 1000
+import json
+import os
+import time
+import click
+from types import SimpleNamespace
+
+# The API modules create an engine on import but never connect here
+os.environ.setdefault('DATABASE_URI', 'postgresql://localhost/site_db')
+
+from api.schema import Matches, PlayerStats, PlayersBySeason, Ladder
+from api.api import *
+
+def make_player(i):
+    return PlayersBySeason(id=i, season=2023, name=f'P.Player{i}',
+        team='Carlton', jumper_number=i % 50)
+
+def make_match(i, num_players=0):
+    match = Matches(id=i, round=i % 24 + 1, season=2023, location='MCG',
+        home_team='Carlton', away_team='Richmond', home_goals=12,
+        home_behinds=10, away_goals=11, away_behinds=14, live=False,
+        time='31:02', percent_complete=100, version=3)
+    match.player_stats = [make_player_stats(i, j, match) for j in range(num_players)]
+    return match
+
+def make_player_stats(match_id, player_id, match=None):
+    player_stats = PlayerStats(match_id=match_id, season=2023,
+        player_id=player_id, position='C', kicks=12, handballs=9, marks=4,
+        goals=1, behinds=2, tackles=5, hitouts=0, frees_for=1,
+        frees_against=2, subbed_on=False, subbed_off=False)
+    player_stats.player = make_player(player_id)
+    player_stats.match = match or make_match(match_id)
+    return player_stats
+
+def make_player_season_stats(i):
+    return SimpleNamespace(id=i, season=2023, name=f'P.Player{i}',
+        team='Carlton', jumper_number=i % 50, games=22, kicks=300,
+        handballs=250, marks=100, goals=20, behinds=15, tackles=90, hitouts=3,
+        frees_for=20, frees_against=18)
+
+def make_ladder(i):
+    return Ladder(team=f'Team {i}', season=2023, round=10, wins=6, losses=3,
+        draws=1, points_for=900, points_against=800 + i)
+
+def time_per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return 1000 * (time.perf_counter() - start) / repeat, result
+
+def compare(schema, encoder, data, many, repeat):
+    def marshmallow_path():
+        dumped = schema.dump(data, many=many)
+        return (json.dumps(dumped, separators=(',', ':'), sort_keys=True)
+            + '\n').encode()
+    marshmallow_ms, expected = time_per_call(marshmallow_path, repeat)
+    encoder_ms, actual = time_per_call(lambda: encoder.encode(data, many), repeat)
+    assert json.loads(expected) == json.loads(actual), 'Outputs differ'
+    return {
+        'marshmallow_ms': marshmallow_ms,
+        'encoder_ms': encoder_ms,
+        'speedup': marshmallow_ms / encoder_ms,
+        'identical_bytes': expected == actual,
+    }
+
+@click.command()
+@click.option('--rows', default=500, type=click.INT)
+@click.option('--repeat', default=20, type=click.INT)
+def main(rows, repeat):
+    players = [make_player(i) for i in range(rows)]
+    player_dicts = [{'id': x.id, 'season': x.season, 'name': x.name,
+        'team': x.team, 'jumper_number': x.jumper_number} for x in players]
+    benchmarks = {
+        'match': (MatchesWithPlayerStatsSchema(), matches_with_player_stats_encoder,
+            make_match(1, 46), False),
+        'player': (PlayerSeasonStatsSchema(), player_season_stats_encoder,
+            [make_player_season_stats(i) for i in range(rows)], True),
+        'players': (PlayerSchema(), player_mapping_encoder, player_dicts, True),
+        'players_by_team': (PlayerSchema(), player_encoder, players, True),
+        'matches_by_round': (MatchesSchema(), matches_encoder,
+            [make_match(i) for i in range(rows)], True),
+        'stats_by_player': (PlayerStatsWithMatchSchema(),
+            player_stats_with_match_encoder,
+            [make_player_stats(i, 1) for i in range(rows)], True),
+        'ladder_by_round': (LadderSchema(), ladder_encoder,
+            [make_ladder(i) for i in range(rows)], True),
+        'data_span': (DataSpanSchema(), data_span_encoder,
+            [SimpleNamespace(season=2014 + i, min_round=1, max_round=27)
+                for i in range(rows)], True),
+    }
+    results = {name: compare(*args, repeat) for name, args in benchmarks.items()}
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
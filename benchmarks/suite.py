@@ -0,0 +1,306 @@
+# Benchmarks the API and ingestion pipeline against a local database and
+# writes the results as JSON, so runs can be compared across commits:
+#   - api: latency of every /api route through the Flask test client
+#   - load: throughput and latency of concurrent requests to gunicorn (or to
+#     a server already running at --url)
+#   - ingest: parsing match XML, upserting a season (with multi-row VALUES
+#     and with COPY), calculate_ladder and update_player_season_stats, all
+#     inside a transaction which is rolled back
+# Run from the repository root, optionally populating the database first
+# (which deletes existing data, see benchmarks/synthetic.py), e.g.
+#   python -m benchmarks.suite --populate 10 --output results.json
+#   python -m benchmarks.suite --sections api,ingest --iterations 50
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import click
+import numpy as np
+import requests
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+
+from api.app import create_app
+from api.cache import invalidate
+from api.db import engine
+from api.schema import Matches, PlayersBySeason, PlayerStats
+from benchmarks.synthetic import new_squads, generate_season, match_xml, \
+    api_urls, populate, reset
+from ingest_historical import parse_match_data, parse_match_columns, \
+    load_batch, calculate_ladder, update_player_season_stats, \
+    MatchBatch
+
+SECTIONS = ['api', 'load', 'ingest']
+
+def summarise(timings, elapsed=None):
+    # Latency percentiles in milliseconds from timings in seconds, and
+    # throughput if the wall clock time taken is given
+    timings = 1000 * np.array(timings)
+    summary = {
+        'count': len(timings),
+        'latency_ms': {
+            'mean': float(timings.mean()),
+            'p50': float(np.percentile(timings, 50)),
+            'p90': float(np.percentile(timings, 90)),
+            'p99': float(np.percentile(timings, 99)),
+            'max': float(timings.max()),
+        },
+    }
+    if elapsed is not None:
+        summary['per_second'] = len(timings) / elapsed
+    return summary
+
+def time_call(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def bench_api(urls, iterations, cold):
+    # With cold, the API's caches are cleared before every request so each
+    # measures the database queries as well as serialisation
+    client = create_app().test_client()
+    results = {}
+    for name, url in urls:
+        # Warm up connections (and with cold off, the caches)
+        status = client.get(url).status_code
+        timings = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            if cold:
+                invalidate('all')
+            elapsed, _ = time_call(client.get, url)
+            timings.append(elapsed)
+        results[name] = {'status': status,
+            **summarise(timings, time.perf_counter() - start)}
+    return results
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(workers, threads):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn',
+        '--workers', str(workers), '--threads', str(threads),
+        '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+        'api.app:create_app()'])
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'{url}/api/data_span', timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+def bench_load(urls, base_url, concurrency, duration, seed):
+    # Each client thread repeatedly requests a random route until the
+    # duration has passed
+    timings = {name: [] for name, _ in urls}
+    errors = []
+    deadline = time.monotonic() + duration
+    def client(i):
+        rng = random.Random(seed + i)
+        http = requests.Session()
+        while time.monotonic() < deadline:
+            name, url = rng.choice(urls)
+            try:
+                elapsed, response = time_call(http.get, base_url + url,
+                    timeout=30)
+                if response.status_code >= 500:
+                    errors.append(name)
+                timings[name].append(elapsed)
+            except requests.RequestException:
+                errors.append(name)
+    threads = [threading.Thread(target=client, args=(i,))
+        for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    all_timings = [x for name in timings for x in timings[name]]
+    return {
+        'concurrency': concurrency,
+        'errors': len(errors),
+        **summarise(all_timings, elapsed),
+        'routes': {name: summarise(timings[name])
+            for name in timings if timings[name]},
+    }
+
+def bench_ingest(seed):
+    # Generates a season after the latest one in the database (with new match
+    # and player IDs), then times each step of ingesting it. The session
+    # joins an outer transaction with savepoints so the commits made by
+    # upsert_season are rolled back at the end
+    rng = random.Random(seed)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        session = Session(bind=connection,
+            join_transaction_mode='create_savepoint')
+        try:
+            season = (session.query(func.max(Matches.season)).scalar() or 2013) + 1
+            next_match_id = (session.query(func.max(Matches.id)).scalar() or 0) + 1
+            next_player_id = \
+                (session.query(func.max(PlayersBySeason.id)).scalar() or 0) + 1
+            squads, next_player_id = new_squads(rng, next_player_id)
+            matches, players, player_stats, next_player_id, next_match_id = \
+                generate_season(rng, season, squads, next_player_id, next_match_id)
+            results = {'season': season, 'matches': len(matches),
+                'player_stats': len(player_stats)}
+
+            players_by_id = {x['id']: x for x in players}
+            stats_by_match = {}
+            for row in player_stats:
+                stats_by_match.setdefault(row['match_id'], []).append(row)
+            documents = [match_xml(match, players_by_id, stats_by_match[match['id']])
+                for match in matches]
+            timings = []
+            start = time.perf_counter()
+            for match, content in zip(matches, documents):
+                elapsed, _ = time_call(parse_match_data, match['id'], content)
+                timings.append(elapsed)
+            results['parse_match_data'] = {
+                'bytes_per_match': sum(map(len, documents)) / len(documents),
+                **summarise(timings, time.perf_counter() - start),
+            }
+
+            elapsed, _ = time_call(upsert_season, session, matches,
+                player_stats, players)
+            results['upsert_season'] = {'seconds': elapsed,
+                'rows_per_second': (len(matches) + len(players)
+                    + len(player_stats)) / elapsed}
+            # Again, when every row conflicts
+            elapsed, _ = time_call(upsert_season, session, matches,
+                player_stats, players)
+            results['upsert_season_existing'] = {'seconds': elapsed}
+            elapsed, _ = time_call(calculate_ladder, session, season)
+            results['calculate_ladder'] = {'seconds': elapsed}
+            elapsed, _ = time_call(calculate_ladder, session, season,
+                from_round=max(x['round'] for x in matches))
+            results['calculate_ladder_last_round'] = {'seconds': elapsed}
+            elapsed, _ = time_call(update_player_season_stats, session, season)
+            results['update_player_season_stats'] = {'seconds': elapsed}
+            player_ids = [x['player_id'] for x in stats_by_match[matches[-1]['id']]]
+            elapsed, _ = time_call(update_player_season_stats, session, season,
+                player_ids)
+            results['update_player_season_stats_match'] = {'seconds': elapsed}
+
+            # The following season, bulk loaded from parsed XML with COPY
+            matches, players, player_stats, _, _ = generate_season(rng,
+                season + 1, squads, next_player_id, next_match_id)
+            players_by_id = {x['id']: x for x in players}
+            stats_by_match = {}
+            for row in player_stats:
+                stats_by_match.setdefault(row['match_id'], []).append(row)
+            batch = MatchBatch()
+            for match in matches:
+                parse_match_columns(match['id'], match_xml(match, players_by_id,
+                    stats_by_match[match['id']]), batch)
+            batch.matches['live'] = [False] * len(batch)
+            elapsed, _ = time_call(load_batch, session, batch)
+            results['load_batch'] = {'seconds': elapsed,
+                'rows_per_second': (len(matches) + len(players)
+                    + len(player_stats)) / elapsed}
+            elapsed, _ = time_call(load_batch, session, batch)
+            results['load_batch_existing'] = {'seconds': elapsed}
+        finally:
+            session.close()
+            transaction.rollback()
+    return results
+
+# Multi-row VALUES upserts, as used before load_batch, for comparison
+def upsert_season(session, match_stats, player_stats, player_season_stats):
+    if not match_stats:
+        return
+    query = insert(Matches).values(match_stats)\
+        .on_conflict_do_nothing()
+    session.execute(query)
+    query = insert(PlayersBySeason).values(player_season_stats)\
+        .on_conflict_do_nothing()
+    session.execute(query)
+    session.commit()
+    query = insert(PlayerStats).values(player_stats)\
+        .on_conflict_do_nothing()
+    session.execute(query)
+    session.commit()
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@click.command()
+@click.option('--sections', default=','.join(SECTIONS),
+    help='Comma separated subset of ' + ', '.join(SECTIONS))
+@click.option('--populate', 'populate_seasons', default=0, type=click.INT,
+    help='Replace all data with this many synthetic seasons first')
+@click.option('--seed', default=0, type=click.INT)
+@click.option('--iterations', default=20, type=click.INT)
+@click.option('--cold', is_flag=True, help='Clear API caches before each request')
+@click.option('--url', default=None, help='Load test this server instead of gunicorn')
+@click.option('--workers', default=4, type=click.INT)
+@click.option('--threads', default=4, type=click.INT)
+@click.option('--concurrency', default=32, type=click.INT)
+@click.option('--duration', default=20, type=click.FLOAT)
+@click.option('--output', default=None, type=click.Path(),
+    help='Write results to this file rather than stdout')
+def main(sections, populate_seasons, seed, iterations, cold, url, workers,
+        threads, concurrency, duration, output):
+    sections = sections.split(',')
+    if populate_seasons:
+        with Session(engine) as session:
+            reset(session)
+            populate(session, populate_seasons, seed=seed)
+    with Session(engine) as session:
+        urls = api_urls(session)
+        data = {
+            'seasons': session.query(func.count(Matches.season.distinct())).scalar(),
+            'matches': session.query(func.count(Matches.id)).scalar(),
+        }
+    results = {
+        'commit': git_commit(),
+        'time': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'data': data,
+    }
+    if 'api' in sections:
+        print('Benchmarking API routes', file=sys.stderr)
+        results['api'] = bench_api(urls, iterations, cold)
+    if 'load' in sections:
+        print('Load testing API', file=sys.stderr)
+        process = None
+        if url is None:
+            process, url = start_gunicorn(workers, threads)
+        try:
+            results['load'] = bench_load(urls, url.rstrip('/'), concurrency,
+                duration, seed)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        results['load']['server'] = {'workers': workers, 'threads': threads} \
+            if process is not None else {'url': url}
+    if 'ingest' in sections:
+        print('Benchmarking ingestion', file=sys.stderr)
+        results['ingest'] = bench_ingest(seed)
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+# Deterministic synthetic data for benchmarks, at roughly the cardinality of
+# the real dataset per season: 18 teams with squads of 44 players (about 10%
+# of whom change each season), 9 matches in each of 24 home and away rounds
+# and 22 players per side in each match. Scale up by adding seasons, e.g.
+#   python -m benchmarks.synthetic --seasons 10 --reset    # about today's volume
+#   python -m benchmarks.synthetic --seasons 1000 --reset  # 100 times
+# Only run this against a local database: --reset deletes all existing data
+import random
+import click
+from xml.etree import ElementTree
+from sqlalchemy import text, insert, desc
+from sqlalchemy.orm import Session
+
+from api.db import engine, TEAMS
+from api.schema import *
+
+NUM_ROUNDS = 24
+SQUAD_SIZE = 44
+PLAYERS_PER_SIDE = 22
+TURNOVER = 0.1
+POSITIONS = ['BPL', 'FB', 'BPR', 'HBFL', 'CHB', 'HBFR', 'WL', 'C', 'WR',
+    'HFFL', 'CHF', 'HFFR', 'FPL', 'FF', 'FPR', 'RK', 'RR', 'R', 'INT', 'INT',
+    'INT', 'INT']
+SYLLABLES = ['an', 'ber', 'cot', 'dan', 'el', 'for', 'gan', 'hol', 'ing',
+    'kel', 'lan', 'mor', 'nor', 'ric', 'son', 'tan', 'vey', 'wal']
+LOCATIONS = ['MCG', 'Marvel Stadium', 'Adelaide Oval', 'Optus Stadium',
+    'SCG', 'Gabba', 'GMHBA Stadium', 'People First Stadium']
+INSERT_CHUNK_SIZE = 5000
+
+def random_name(rng):
+    surname = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+    return f'{rng.choice("ABCDEGHJKLMNPRSTW")}.{surname.capitalize()}'
+
+def insert_chunked(session, model, rows):
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        session.execute(insert(model), rows[i:i + INSERT_CHUNK_SIZE])
+
+def new_squads(rng, next_player_id):
+    # Returns squads for every team with player IDs from next_player_id, and
+    # the next unused player ID
+    squads = {}
+    for name, _ in TEAMS:
+        squads[name] = [(next_player_id + i, random_name(rng))
+            for i in range(SQUAD_SIZE)]
+        next_player_id += SQUAD_SIZE
+    return squads, next_player_id
+
+def generate_season(rng, season, squads, next_player_id, next_match_id):
+    # Returns matches, players and player stats for a season, updating squads
+    # (team -> list of (player ID, name)) with the season's turnover
+    teams = list(squads)
+    players = []
+    for team in teams:
+        squad = squads[team]
+        for i in range(len(squad)):
+            if rng.random() < TURNOVER:
+                squad[i] = (next_player_id, random_name(rng))
+                next_player_id += 1
+        players.extend({
+            'id': player_id,
+            'season': season,
+            'name': name,
+            'team': team,
+            'jumper_number': i + 1,
+        } for i, (player_id, name) in enumerate(squad))
+    matches = []
+    player_stats = []
+    for round in range(1, NUM_ROUNDS + 1):
+        order = teams[:]
+        rng.shuffle(order)
+        for home_team, away_team in zip(order[::2], order[1::2]):
+            match_id = next_match_id
+            next_match_id += 1
+            matches.append({
+                'id': match_id,
+                'round': round,
+                'season': season,
+                'location': rng.choice(LOCATIONS),
+                'home_team': home_team,
+                'away_team': away_team,
+                'home_goals': rng.randint(5, 20),
+                'home_behinds': rng.randint(3, 16),
+                'away_goals': rng.randint(5, 20),
+                'away_behinds': rng.randint(3, 16),
+                'live': False,
+                'time': f'{rng.randint(28, 34)}:{rng.randint(0, 59):02}',
+                'percent_complete': 100,
+            })
+            for team in (home_team, away_team):
+                selected = rng.sample(squads[team], PLAYERS_PER_SIDE)
+                for (player_id, _), position in zip(selected, POSITIONS):
+                    kicks = rng.randint(2, 25)
+                    player_stats.append({
+                        'match_id': match_id,
+                        'season': season,
+                        'player_id': player_id,
+                        'position': position,
+                        'kicks': kicks,
+                        'handballs': rng.randint(1, 20),
+                        'marks': rng.randint(0, kicks // 2 + 1),
+                        'goals': rng.choices(range(6), weights=[50, 25, 12, 7, 4, 2])[0],
+                        'behinds': rng.choices(range(4), weights=[60, 25, 10, 5])[0],
+                        'tackles': rng.randint(0, 10),
+                        'hitouts': rng.randint(20, 45) if position == 'RK' else 0,
+                        'frees_for': rng.randint(0, 4),
+                        'frees_against': rng.randint(0, 4),
+                        'subbed_on': False,
+                        'subbed_off': False,
+                    })
+    return matches, players, player_stats, next_player_id, next_match_id
+
+def match_xml(match, players, player_stats):
+    # Renders a generated match in the DTLive XML format read by
+    # parse_match_data in ingest_historical.py. players maps player IDs to
+    # players_by_season rows and player_stats are the match's rows
+    from ingest_historical import MATCH_PROPERTIES_MAP, PLAYER_PROPERTIES_MAP, \
+        TEAM_NAMES
+    xml_team_names = {name: xml_name for xml_name, name in TEAM_NAMES.items()}
+    def team_name(team):
+        return xml_team_names.get(team, team)
+    root = ElementTree.Element('Match')
+    game = ElementTree.SubElement(root, 'Game')
+    values = {**match, 'home_team': team_name(match['home_team']),
+        'away_team': team_name(match['away_team'])}
+    for tag, key in MATCH_PROPERTIES_MAP.items():
+        ElementTree.SubElement(game, tag).text = str(values[key])
+    sides = {'Home': ElementTree.SubElement(root, 'Home'),
+        'Away': ElementTree.SubElement(root, 'Away')}
+    for row in player_stats:
+        player = players[row['player_id']]
+        side = 'Home' if player['team'] == match['home_team'] else 'Away'
+        element = ElementTree.SubElement(sides[side], 'Player')
+        ElementTree.SubElement(element, 'Name').text = player['name']
+        ElementTree.SubElement(element, 'JumperNumber').text = \
+            str(player['jumper_number'])
+        for tag, key in PLAYER_PROPERTIES_MAP.items():
+            ElementTree.SubElement(element, tag).text = str(row[key])
+        ElementTree.SubElement(element, 'IconImage').text = \
+            'greenvest.png' if row['subbed_on'] else \
+            'redvest.png' if row['subbed_off'] else ''
+    return ElementTree.tostring(root, encoding='utf-8')
+
+def api_urls(session):
+    # A URL for every /api route, with parameters taken from the latest round
+    match = session.query(Matches)\
+        .order_by(desc(Matches.season), desc(Matches.round))\
+        .limit(1).one()
+    player_ids = [x[0] for x in session.query(PlayerStats.player_id)\
+        .where(PlayerStats.match_id == match.id)\
+        .limit(4).all()]
+    player_id = player_ids[0]
+    season, round = match.season, max(match.round - 1, 1)
+    return [
+        ('match', f'/api/match/{match.id}'),
+        ('player', f'/api/player/{player_id}'),
+        ('search_players', '/api/players/an'),
+        ('random_player', '/api/random_player'),
+        ('random_player_hourly', '/api/random_player?mode=hourly'),
+        ('players_by_team', f'/api/players_by_team/{match.home_team}'),
+        ('current_matches', '/api/current_matches'),
+        ('matches_by_round', f'/api/matches_by_round/{season}/{round}'),
+        ('matches_by_team', f'/api/matches_by_team/{match.home_team}?include_count=true'),
+        ('stats_by_player', f'/api/stats_by_player/{player_id}?include_count=true'),
+        ('current_ladder', '/api/current_ladder'),
+        ('ladder_by_round', f'/api/ladder_by_round/{season}/{round}'),
+        ('data_span', '/api/data_span'),
+        ('season_leaders', f'/api/leaders/{match.season}/disposals'),
+        ('round_leaders', f'/api/leaders/{season}/{round}/goals'),
+        ('compare', '/api/compare?'
+            + '&'.join(f'player_id={x}' for x in player_ids)),
+        ('percentiles', f'/api/percentiles/{player_id}/{match.season}'),
+        ('histogram', f'/api/histogram/{match.season}/tackles?position=midfielders'),
+    ]
+
+def populate(session, num_seasons, first_season=2014, seed=0):
+    # Imported here so that generating data does not require the ingest
+    # script's dependencies unless they are used
+    from ingest_historical import calculate_ladder, update_player_season_stats, \
+        rebuild_leaders
+    from api.analytics import build_stat_cube
+    rng = random.Random(seed)
+    existing_teams = {x[0] for x in session.query(Teams.name).all()}
+    session.add_all([Teams(name=name, nickname=nickname)
+        for name, nickname in TEAMS if name not in existing_teams])
+    session.commit()
+    squads, next_player_id = new_squads(rng, 1)
+    next_match_id = 1
+    for season in range(first_season, first_season + num_seasons):
+        matches, players, player_stats, next_player_id, next_match_id = \
+            generate_season(rng, season, squads, next_player_id, next_match_id)
+        insert_chunked(session, Matches, matches)
+        insert_chunked(session, PlayersBySeason, players)
+        insert_chunked(session, PlayerStats, player_stats)
+        calculate_ladder(session, season)
+        session.commit()
+        print(f'{season}: {len(matches)} matches and {len(player_stats)}'
+            ' player stats generated')
+    update_player_season_stats(session)
+    for season in range(first_season, first_season + num_seasons):
+        rebuild_leaders(session, season)
+    session.commit()
+    for table in ['matches', 'players_by_season', 'player_stats', 'ladder',
+            'player_season_stats']:
+        session.execute(text(f'ANALYZE {table};'))
+    session.commit()
+    build_stat_cube(session)
+
+def reset(session):
+    session.execute(text('TRUNCATE player_stats, player_season_stats, ladder,'
+        ' season_leaders, round_leaders, players_by_season, matches;'))
+    session.commit()
+
+@click.command()
+@click.option('--seasons', default=10, type=click.INT)
+@click.option('--first_season', default=2014, type=click.INT)
+@click.option('--seed', default=0, type=click.INT)
+@click.option('--reset', 'reset_data', is_flag=True,
+    help='Delete all existing data first')
+def main(seasons, first_season, seed, reset_data):
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        if reset_data:
+            reset(session)
+        populate(session, seasons, first_season, seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Load test for websocket/server.py: connects many local websocket clients,
+# posts a series of live match updates and reports how long each update took
+# to reach each client. Run the websocket server first, e.g.
+#   python websocket/server.py
+#   python benchmarks/websocket_load.py --clients 2000 --updates 50
+import asyncio
+import json
+import os
+import time
+import click
+import numpy as np
+from dotenv import load_dotenv
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.websocket import websocket_connect
+
+load_dotenv()
+
+MATCH_ID = 999999
+
+def sample_match(num_players=46):
+    return {
+        'id': MATCH_ID,
+        'season': 2024,
+        'round': 1,
+        'location': 'MCG',
+        'home_team': 'Carlton',
+        'away_team': 'Richmond',
+        'home_goals': 0,
+        'home_behinds': 0,
+        'away_goals': 0,
+        'away_behinds': 0,
+        'home_score': 0,
+        'away_score': 0,
+        'live': True,
+        'time': '0:00',
+        'percent_complete': 0,
+        'player_stats': [{
+            'match_id': MATCH_ID,
+            'season': 2024,
+            'player_id': i,
+            'position': 'INT',
+            'kicks': 0,
+            'handballs': 0,
+            'marks': 0,
+            'goals': 0,
+            'behinds': 0,
+            'tackles': 0,
+            'hitouts': 0,
+            'frees_for': 0,
+            'frees_against': 0,
+            'subbed_on': False,
+            'subbed_off': False,
+            'player': {
+                'id': i,
+                'season': 2024,
+                'name': f'P.Player{i}',
+                'team': 'Carlton' if i % 2 else 'Richmond',
+                'jumper_number': i,
+            },
+        } for i in range(num_players)],
+    }
+
+class Client:
+    def __init__(self, received):
+        self.received = received
+        self.bytes = 0
+
+    async def run(self, url, origin, topic, ready):
+        connection = await websocket_connect(HTTPRequest(url,
+            headers={'Origin': origin}))
+        await connection.write_message(json.dumps(
+            {'event': 'subscribe', 'topics': [topic]}))
+        ready.release()
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                return
+            self.bytes += len(message)
+            try:
+                message = json.loads(message)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(message, dict) and message.get('type') == 'delta':
+                self.received.append((message['seq'], time.perf_counter()))
+
+async def run_load_test(ws_url, http_url, origin, num_clients, num_updates,
+        interval, topic):
+    http = AsyncHTTPClient()
+    headers = {'Authorization': f'Bearer {os.getenv("WEBSOCKET_SECRET")}'}
+    async def post(message):
+        await http.fetch(http_url, method='POST', headers=headers,
+            body=json.dumps(message))
+
+    match = sample_match()
+    # Mark the match as finished first so the server starts from a snapshot
+    await post({'type': 'snapshot', 'match': {**match, 'live': False}})
+    await post({'type': 'snapshot', 'match': match})
+
+    ready = asyncio.Semaphore(0)
+    clients = [Client([]) for _ in range(num_clients)]
+    tasks = [asyncio.create_task(x.run(ws_url, origin, topic, ready))
+        for x in clients]
+    for _ in clients:
+        await ready.acquire()
+
+    sent = {}
+    for i in range(1, num_updates + 1):
+        match['time'] = f'{i // 60}:{i % 60:02}'
+        player_stats = match['player_stats'][i % len(match['player_stats'])]
+        player_stats['kicks'] += 1
+        sent[i + 1] = time.perf_counter()
+        await post({
+            'type': 'update',
+            'match': {k: v for k, v in match.items() if k != 'player_stats'},
+            'player_stats': [player_stats],
+        })
+        await asyncio.sleep(interval)
+    # Allow stragglers to receive the last updates
+    await asyncio.sleep(max(1, 10 * interval))
+    for task in tasks:
+        task.cancel()
+    await post({'type': 'snapshot', 'match': {**match, 'live': False}})
+
+    latencies = np.array([1000 * (received - sent[seq])
+        for client in clients for seq, received in client.received if seq in sent])
+    expected = num_clients * num_updates
+    return {
+        'clients': num_clients,
+        'updates': num_updates,
+        'messages_expected': expected,
+        'messages_received': len(latencies),
+        'bytes_per_client': sum(x.bytes for x in clients) / max(num_clients, 1),
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)),
+            'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(latencies.max()),
+        } if len(latencies) else None,
+    }
+
+@click.command()
+@click.option('--ws_url', default='ws://localhost:7000/ws')
+@click.option('--http_url', default='http://localhost:7000/')
+@click.option('--origin', default='http://localhost:5000')
+@click.option('--clients', default=1000, type=click.INT)
+@click.option('--updates', default=20, type=click.INT)
+@click.option('--interval', default=0.1, type=click.FLOAT)
+@click.option('--topic', default=f'match:{MATCH_ID}')
+def main(ws_url, http_url, origin, clients, updates, interval, topic):
+    results = asyncio.run(run_load_test(ws_url, http_url, origin, clients,
+        updates, interval, topic))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,35 @@
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, desc, and_, or_, text, update
+from sqlalchemy import create_engine, desc, text, update, select, func, delete
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
-from xml.etree import ElementTree
-from lxml.etree import XMLParser
+from lxml.etree import XMLParser, fromstring
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import itertools
+import threading
+import io
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import pandas as pd
 import requests
+import click
 import os
 
 from api.schema import *
+from api.cache import notify_cache_invalidation
+from api.analytics import build_stat_cube
+from archive import XmlArchive
 
 load_dotenv()
 engine = create_engine(os.getenv('DATABASE_URI'))
 
-BASE_URL = 'https://www.dtlive.com.au/afl/xml'
+# Can be pointed at a local server (e.g. python -m http.server in a directory
+# of saved XML files) for testing
+BASE_URL = os.getenv('DTLIVE_BASE_URL', 'https://www.dtlive.com.au/afl/xml')
+REQUEST_TIMEOUT = 30
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
 SEASON_MATCH_IDS = {
     2014: (19, 639),
     2015: (667, 873),
@@ -52,167 +69,595 @@ PLAYER_PROPERTIES_MAP = {
     'Behind': 'behinds',
     'Selection': 'position',
 }
+# Handle different name in dataset for GWS
+TEAM_NAMES = {'GWS Giants': 'Greater Western Sydney'}
+# Columns of each table in a MatchBatch
+MATCH_COLUMNS = ['id', *MATCH_PROPERTIES_MAP.values()]
+PLAYER_STATS_COLUMNS = ['match_id', 'season', *PLAYER_PROPERTIES_MAP.values(),
+    'subbed_on', 'subbed_off']
+PLAYER_COLUMNS = ['id', 'season', 'name', 'team', 'jumper_number']
+# Each player element's properties are read into a row with these columns,
+# looked up by tag
+PLAYER_ROW_COLUMNS = [*PLAYER_PROPERTIES_MAP.values(), 'name', 'jumper_number',
+    'icon']
+PLAYER_TAG_INDEXES = {tag: PLAYER_ROW_COLUMNS.index(col) for tag, col in {
+    **PLAYER_PROPERTIES_MAP,
+    'Name': 'name',
+    'JumperNumber': 'jumper_number',
+    'IconImage': 'icon',
+}.items()}
+# Matches loaded and committed at a time, after which the season's checkpoint
+# is updated
+DEFAULT_CHUNK_SIZE = 50
+# Rows copied into the staging tables and merged at a time when bulk loading
+COPY_CHUNK_SIZE = 5000
+SEASON_STATS_COLUMNS = ['kicks', 'handballs', 'marks', 'goals', 'behinds',
+    'tackles', 'hitouts', 'frees_for', 'frees_against']
+LADDER_COLUMNS = ['wins', 'losses', 'draws', 'points_for', 'points_against']
 
-def get_match_data(match_number):
+def create_http_session(max_connections=DEFAULT_MAX_WORKERS,
+        retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    # Connections are pooled and reused across requests (and threads). Failed
+    # connections and transient server errors are retried with exponential
+    # backoff; 404s are not retried since they mean no match exists
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'],
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections,
+        max_retries=retry)
+    http = requests.Session()
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    return http
+
+_http_session = None
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        _http_session = create_http_session()
+    return _http_session
+
+def fetch_match_xml(match_number, http=None, headers=None):
+    http = http or get_http_session()
     url = f'{BASE_URL}/{match_number}.xml'
-    response = requests.get(url)
+    response = http.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
-    root = ElementTree.fromstring(response.text.encode('utf-8'),
-        parser=XMLParser(encoding='utf-8', recover=True))
-    match_stats = {'id': match_number}
-    player_stats = []
-    player_season_stats = []
+    return response
+
+def get_match_data(match_number, http=None, archive=None):
+    response = fetch_match_xml(match_number, http)
+    match_data = parse_match_data(match_number, response.content)
+    if archive is not None:
+        archive.put(match_number, response.content, match_data[0]['season'])
+    return match_data
+
+class MatchBatch:
+    # Parsed matches stored column-wise: each table maps its column names to
+    # lists of values, one per row, which can be inserted in bulk
+    def __init__(self):
+        self.matches = {col: [] for col in MATCH_COLUMNS}
+        self.player_stats = {col: [] for col in PLAYER_STATS_COLUMNS}
+        self.players = {col: [] for col in PLAYER_COLUMNS}
+
+    def __len__(self):
+        return len(self.matches['id'])
+
+    def tables(self):
+        return self.matches, self.player_stats, self.players
+
+    def extend(self, other):
+        for table, other_table in zip(self.tables(), other.tables()):
+            for col, values in other_table.items():
+                table.setdefault(col, []).extend(values)
+
+    def records(self):
+        # Rows of each table as dicts
+        return tuple([dict(zip(table, row)) for row in zip(*table.values())]
+            for table in self.tables())
+
+_parsers = threading.local()
+def get_xml_parser():
+    # lxml parsers cannot be shared between threads
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = _parsers.parser = XMLParser(encoding='utf-8', recover=True)
+    return parser
+
+def parse_match_columns(match_number, content, batch=None):
+    # Parse a match's XML (as bytes, undecoded) into a MatchBatch, appending
+    # to the given batch if any. Properties missing from the XML are None
+    batch = batch if batch is not None else MatchBatch()
+    root = fromstring(content, get_xml_parser())
+    match = dict.fromkeys(MATCH_COLUMNS)
+    match['id'] = match_number
+    sides = []
     for child in root:
         if child.tag == 'Game':
             for property in child:
-                if property.tag in MATCH_PROPERTIES_MAP:
-                    key = MATCH_PROPERTIES_MAP[property.tag]
-                    match_stats[key] = property.text
-                    # Handle different name in dataset for GWS
-                    if (key == 'home_team' or key == 'away_team') and \
-                            property.text == 'GWS Giants':
-                        match_stats[key] = 'Greater Western Sydney'
-        elif child.tag in ['Home', 'Away']:
-            for player in child:
-                _player_stats = {
-                    'match_id': match_number,
-                    'season': match_stats['season'],
-                    'subbed_on': False,
-                    'subbed_off': False,
-                }
-                _player_season_stats = {'season': match_stats['season']}
-                for property in player:
-                    if property.tag in PLAYER_PROPERTIES_MAP:
-                        key = PLAYER_PROPERTIES_MAP[property.tag]
-                        _player_stats[key] = property.text
-                        if key == 'position' and property.text and \
-                                property.text.startswith('INT'):
-                            _player_stats[key] = 'INT'
-                    if property.tag == 'IconImage':
-                        if property.text == 'greenvest.png':
-                            _player_stats['subbed_on'] = True
-                        elif property.text == 'redvest.png':
-                            _player_stats['subbed_off'] = True
-                    if property.tag == 'Name':
-                        _player_season_stats['name'] = property.text
-                    if property.tag == 'PlayerID':
-                        _player_season_stats['id'] = property.text
-                    if property.tag == 'JumperNumber':
-                        _player_season_stats['jumper_number'] = property.text
-                    _player_season_stats['team'] = match_stats['home_team'] \
-                        if child.tag == 'Home' else match_stats['away_team']
-                player_stats.append(_player_stats)
-                player_season_stats.append(_player_season_stats)
+                key = MATCH_PROPERTIES_MAP.get(property.tag)
+                if key is not None:
+                    match[key] = property.text
+        elif child.tag == 'Home' or child.tag == 'Away':
+            sides.append(child)
+    for key in ['home_team', 'away_team']:
+        match[key] = TEAM_NAMES.get(match[key], match[key])
+    for col, values in batch.matches.items():
+        values.append(match.get(col))
+
+    season = match['season']
+    stats = batch.player_stats
+    players = batch.players
+    stats_columns = [stats[col] for col in PLAYER_PROPERTIES_MAP.values()]
+    player_id_index, position_index, name_index, jumper_number_index, \
+        icon_index = [PLAYER_ROW_COLUMNS.index(col) for col in
+            ['player_id', 'position', 'name', 'jumper_number', 'icon']]
+    num_columns = len(PLAYER_ROW_COLUMNS)
+    for side in sides:
+        team = match['home_team'] if side.tag == 'Home' else match['away_team']
+        for player in side:
+            row = [None] * num_columns
+            for property in player:
+                index = PLAYER_TAG_INDEXES.get(property.tag)
+                if index is not None:
+                    row[index] = property.text
+            position = row[position_index]
+            if position and position.startswith('INT'):
+                row[position_index] = 'INT'
+            for values, value in zip(stats_columns, row):
+                values.append(value)
+            stats['match_id'].append(match_number)
+            stats['season'].append(season)
+            stats['subbed_on'].append(row[icon_index] == 'greenvest.png')
+            stats['subbed_off'].append(row[icon_index] == 'redvest.png')
+            players['id'].append(row[player_id_index])
+            players['season'].append(season)
+            players['name'].append(row[name_index])
+            players['team'].append(team)
+            players['jumper_number'].append(row[jumper_number_index])
+    return batch
+
+def parse_match_data(match_number, content):
+    # Returns the match, its player stats and its players as dicts
+    (match_stats,), player_stats, player_season_stats = \
+        parse_match_columns(match_number, content).records()
     return match_stats, player_stats, player_season_stats
 
-def calculate_ladder(session, season=None, latest_round=True):
+def _fetch_match(match_number, http, archive):
+    try:
+        response = fetch_match_xml(match_number, http)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            print(f'No match found with ID {match_number}')
+            return None
+        print(f'Failed to fetch match with ID {match_number}: {e}')
+        raise
+    except requests.RequestException as e:
+        # Stop rather than skip the match, so it is fetched when resuming
+        print(f'Failed to fetch match with ID {match_number}: {e}')
+        raise
+    batch = parse_match_columns(match_number, response.content)
+    if archive is not None:
+        archive.put(match_number, response.content, batch.matches['season'][0])
+    return batch
+
+def fetch_matches(match_ids, max_workers=DEFAULT_MAX_WORKERS, http=None,
+        archive=None):
+    # Fetch and parse matches concurrently, yielding (match ID, MatchBatch) in
+    # order of the given IDs, with the batch None if there is no match with
+    # that ID; other failures (after retrying) are raised. No more than twice
+    # max_workers matches are in flight or waiting to be consumed at any
+    # time, so memory use stays bounded. The raw XML of each match is saved
+    # to the archive if one is given
+    http = http or create_http_session(max_workers)
+    match_ids = iter(match_ids)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers) as executor:
+        def submit_next():
+            match_id = next(match_ids, None)
+            if match_id is not None:
+                pending.append((match_id,
+                    executor.submit(_fetch_match, match_id, http, archive)))
+        for _ in range(2 * max_workers):
+            submit_next()
+        while pending:
+            match_id, future = pending.popleft()
+            submit_next()
+            yield match_id, future.result()
+
+def replay_matches(archive, match_ids):
+    # As fetch_matches, but reading the latest version of each match from the
+    # archive and skipping those not in it
+    archived = set(archive.match_ids())
+    for match_id, content in archive.read_matches(
+            [x for x in match_ids if x in archived]):
+        yield match_id, parse_match_columns(match_id, content)
+
+def copy_value(value):
+    # A value in PostgreSQL's COPY text format
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t')\
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+def merge_rows(session, table, columns, rows, key, overwrite=True):
+    # Stream rows (tuples of values for the given columns) into a temporary
+    # staging table with COPY, then merge them into the table with a single
+    # INSERT ... ON CONFLICT. With overwrite, existing rows which differ are
+    # updated, otherwise they are left as is
+    staging = f'staging_{table}'
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key)
+    session.execute(text(f'CREATE TEMP TABLE IF NOT EXISTS {staging}'
+        f' (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;'))
+    session.execute(text(f'TRUNCATE {staging};'))
+    # Only the last row with each key is kept, as INSERT ... ON CONFLICT
+    # cannot update a row twice
+    key_indexes = [columns.index(col) for col in key]
+    rows = {tuple(row[i] for i in key_indexes): row for row in rows}
+    buffer = io.StringIO()
+    for row in rows.values():
+        buffer.write('\t'.join(map(copy_value, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    with session.connection().connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {staging} ({column_list}) FROM STDIN', buffer)
+    if overwrite:
+        updated = [col for col in columns if col not in key]
+        conflict = f'''DO UPDATE SET {', '.join(f'{col} = EXCLUDED.{col}' for col in updated)}
+            WHERE ({', '.join(f'{table}.{col}' for col in updated)})
+            IS DISTINCT FROM ({', '.join(f'EXCLUDED.{col}' for col in updated)})'''
+    else:
+        conflict = 'DO NOTHING'
+    session.execute(text(f'''
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging}
+        ON CONFLICT ({key_list}) {conflict}
+    '''))
+
+def chunks(table, chunk_size):
+    # Rows of a column-oriented table as tuples, chunk_size at a time
+    rows = zip(*table.values())
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def load_batch(session, batch, chunk_size=COPY_CHUNK_SIZE):
+    # Bulk load a MatchBatch, replacing existing matches and player stats and
+    # adding players not already in players_by_season. Tables are loaded in
+    # order of their foreign keys, chunk_size rows at a time
+    if not len(batch):
+        return
+    # A player appears once per match, so only copy their first appearance
+    players = {col: [] for col in batch.players}
+    seen = set()
+    for row in zip(*batch.players.values()):
+        player_key = row[0], row[1]
+        if player_key not in seen:
+            seen.add(player_key)
+            for values, value in zip(players.values(), row):
+                values.append(value)
+    for table, columns, key, overwrite in [
+        ('matches', batch.matches, ['id'], True),
+        ('players_by_season', players, ['id', 'season'], False),
+        ('player_stats', batch.player_stats, ['match_id', 'player_id'], True),
+    ]:
+        for chunk in chunks(columns, chunk_size):
+            merge_rows(session, table, list(columns), chunk, key, overwrite)
+
+def accumulate_ladder(matches, teams, last_round):
+    # Each team's cumulative results after each round from 1 to last_round,
+    # from a DataFrame of a season's completed matches
+
+    # One row per team per match, from that team's perspective
+    results = pd.concat([
+        pd.DataFrame({
+            'team': matches['home_team'],
+            'round': matches['round'],
+            'points_for': matches['home_score'],
+            'points_against': matches['away_score'],
+        }),
+        pd.DataFrame({
+            'team': matches['away_team'],
+            'round': matches['round'],
+            'points_for': matches['away_score'],
+            'points_against': matches['home_score'],
+        }),
+    ])
+    # Rounds before round 1 (e.g. an opening round numbered 0) are counted
+    # in round 1's totals
+    results['round'] = results['round'].clip(lower=1)
+    results['wins'] = (results['points_for'] > results['points_against']).astype(int)
+    results['losses'] = (results['points_for'] < results['points_against']).astype(int)
+    results['draws'] = (results['points_for'] == results['points_against']).astype(int)
+    # Every team gets a row for every round, including byes and rounds before
+    # their first match
+    index = pd.MultiIndex.from_product([teams, range(1, last_round + 1)],
+        names=['team', 'round'])
+    ladder = results.groupby(['team', 'round'])[LADDER_COLUMNS].sum()\
+        .reindex(index, fill_value=0)\
+        .groupby(level='team').cumsum()\
+        .reset_index()
+    return ladder
+
+def calculate_ladder(session, season=None, latest_round=True, from_round=1):
     # Default to latest season and round
-    latest_match = session.query(Matches)\
-        .where(Matches.live == False)\
-        .order_by(desc(Matches.season), desc(Matches.round))\
-        .limit(1).one()
     if season is None:
-        season = latest_match.season
+        season = session.query(Matches.season)\
+            .where(Matches.live == False)\
+            .order_by(desc(Matches.season))\
+            .limit(1).one()[0]
+    # Load the season's completed matches once and accumulate each team's
+    # results round by round, rather than querying per team and round
+    matches = session.query(Matches.round, Matches.home_team, Matches.away_team,
+            Matches.home_score.label('home_score'),
+            Matches.away_score.label('away_score'))\
+        .where(Matches.season == season, Matches.live == False)\
+        .all()
+    if not matches:
+        return
+    matches = pd.DataFrame(matches, columns=['round', 'home_team', 'away_team',
+        'home_score', 'away_score'])
     if latest_round:
-        last_round = latest_match.round
+        last_round = matches['round'].max()
     else:
         # Minus 4 for final home and away round
-        last_round = session.query(Matches.round.distinct())\
-            .where(Matches.live == False)\
-            .order_by(desc(Matches.round)).limit(1).one()[0] - 4
-    teams = session.query(Teams.name).all()
-    teams = [x[0] for x in teams]
-    for team in teams:
-        for round in range(1, last_round + 1):
-            matches = session.query(Matches)\
-                .where(and_(
-                        Matches.season == season,
-                        Matches.round <= round,
-                        Matches.live == False,
-                        or_(Matches.home_team == team, Matches.away_team == team)
-                    ))\
-                .order_by(Matches.id).all()
-            wins = 0
-            losses = 0
-            draws = 0
-            pf = 0
-            pa = 0
-            for _match in matches:
-                if _match.home_score == _match.away_score:
-                    draws += 1
-                    pf += _match.home_score
-                    pa += _match.away_score
-                elif _match.home_team == team:
-                    pf += _match.home_score
-                    pa += _match.away_score
-                    if _match.home_score > _match.away_score:
-                        wins += 1
-                    else:
-                        losses += 1
-                else:
-                    pf += _match.away_score
-                    pa += _match.home_score
-                    if _match.home_score > _match.away_score:
-                        losses += 1
-                    else:
-                        wins += 1
-            team_season_stats = Ladder(**{
-                'team': team,
-                'season': season,
-                'round': round,
-                'wins': wins,
-                'losses': losses,
-                'draws': draws,
-                'points_for': pf,
-                'points_against': pa,
-            })
-            session.merge(team_season_stats)
+        last_round = matches['round'].max() - 4
+    if from_round > last_round:
+        return
+    teams = [x[0] for x in session.query(Teams.name).all()]
+    ladder = accumulate_ladder(matches, teams, last_round)
+    # In incremental mode, earlier rounds are unaffected so are not rewritten
+    ladder = ladder[ladder['round'] >= from_round].assign(season=season)
+    query = insert(Ladder).values(ladder.to_dict('records'))
+    query = query.on_conflict_do_update(constraint='ladder_pkey',
+        set_={col: getattr(query.excluded, col) for col in LADDER_COLUMNS})
+    session.execute(query)
 
-if __name__ == '__main__':
-    for season in SEASON_MATCH_IDS:
-        start_id, end_id = SEASON_MATCH_IDS[season]
-        match_id = start_id
-        match_stats = []
-        player_stats = []
-        player_season_stats = []
-        while match_id <= end_id:
-            try:
-                _match_stats, _player_stats, _player_season_stats = \
-                    get_match_data(match_id)
-                if int(_match_stats['percent_complete']) == 100:
-                    _match_stats['live'] = False
-                else:
-                    _match_stats['live'] = True
-                if match_id % 10 == 0:
-                    print(f'{season}: Data for match with ID {match_id} obtained'
-                        f' ({match_id - start_id} / {end_id - start_id})')
-                match_stats.append(_match_stats)
-                player_stats.extend(_player_stats)
-                player_season_stats.extend(_player_season_stats)
-            except requests.HTTPError:
-                print(f'No match found with ID {match_id}')
-            match_id += 1
+def update_player_season_stats(session, season=None, player_ids=None):
+    # Recalculate season totals from player_stats, either for the given
+    # players in a season (e.g. those in a match which just ended) or, with no
+    # arguments, for every player and season. Rows are upserted individually
+    # so readers of player_season_stats are never blocked
+    query = select(PlayerStats.player_id, PlayerStats.season,
+            func.count(PlayerStats.kicks),
+            *[func.sum(getattr(PlayerStats, col)) for col in SEASON_STATS_COLUMNS])\
+        .group_by(PlayerStats.player_id, PlayerStats.season)
+    if season is not None:
+        query = query.where(PlayerStats.season == season)
+    if player_ids is not None:
+        query = query.where(PlayerStats.player_id.in_(player_ids))
+    columns = ['player_id', 'season', 'games', *SEASON_STATS_COLUMNS]
+    query = insert(PlayerSeasonStats).from_select(columns, query)
+    query = query.on_conflict_do_update(constraint='player_season_stats_pkey',
+        set_={col: getattr(query.excluded, col) for col in columns[2:]})
+    session.execute(query)
+    if season is None and player_ids is None:
+        # Remove totals for players whose stats no longer exist
+        query = delete(PlayerSeasonStats).where(~select(PlayerStats.player_id)\
+            .where(PlayerStats.player_id == PlayerSeasonStats.player_id,
+                PlayerStats.season == PlayerSeasonStats.season)\
+            .exists())
+        session.execute(query)
+
+def leader_values(alias):
+    # A lateral VALUES list of (stat, value) for each leaderboard stat of a row
+    values = ', '.join(f"('{stat}', {' + '.join(f'{alias}.{col}' for col in columns)})"
+        for stat, columns in LEADER_STATS.items())
+    return f'CROSS JOIN LATERAL (VALUES {values}) AS v (stat, value)'
+
+def update_round_leaders(session, season, round):
+    # Recalculate a round's leaderboards from its player stats, which are
+    # bounded by the number of matches in a round. Zero values are not ranked
+    session.execute(delete(RoundLeaders)\
+        .where(RoundLeaders.season == season, RoundLeaders.round == round))
+    session.execute(text(f'''
+        INSERT INTO round_leaders (season, round, stat, player_id, match_id,
+            rank, value)
+        SELECT :season, :round, stat, player_id, match_id, rank, value FROM (
+            SELECT stat, player_id, match_id, value,
+                RANK() OVER (PARTITION BY stat ORDER BY value DESC) AS rank
+            FROM (
+                -- A player's best game if they played more than one in the round
+                SELECT DISTINCT ON (v.stat, ps.player_id) v.stat, ps.player_id,
+                    ps.match_id, v.value
+                FROM matches m
+                JOIN player_stats ps ON ps.match_id = m.id
+                {leader_values('ps')}
+                WHERE m.season = :season AND m.round = :round AND v.value > 0
+                ORDER BY v.stat, ps.player_id, v.value DESC, ps.match_id
+            ) best
+        ) ranked
+        WHERE rank <= :size
+        ON CONFLICT (season, round, stat, player_id) DO UPDATE
+        SET match_id = EXCLUDED.match_id, rank = EXCLUDED.rank,
+            value = EXCLUDED.value
+    '''), {'season': season, 'round': round, 'size': LEADERBOARD_SIZE})
+
+def update_season_leaders(session, season):
+    # Recalculate a season's leaderboards from player_season_stats. Every
+    # player of the season is ranked (about 800 rows), as totals can fall
+    # when stats are corrected or matches are re-ingested
+    session.execute(delete(SeasonLeaders).where(SeasonLeaders.season == season))
+    session.execute(text(f'''
+        INSERT INTO season_leaders (season, stat, player_id, rank, value)
+        SELECT :season, stat, player_id, rank, value FROM (
+            SELECT v.stat, pss.player_id, v.value,
+                RANK() OVER (PARTITION BY v.stat ORDER BY v.value DESC) AS rank
+            FROM player_season_stats pss
+            {leader_values('pss')}
+            WHERE pss.season = :season AND v.value > 0
+        ) ranked
+        WHERE rank <= :size
+    '''), {'season': season, 'size': LEADERBOARD_SIZE})
+
+def rebuild_leaders(session, season):
+    # Recalculate all of a season's leaderboards
+    update_season_leaders(session, season)
+    rounds = session.query(Matches.round.distinct())\
+        .where(Matches.season == season)\
+        .all()
+    for (round,) in rounds:
+        update_round_leaders(session, season, round)
+
+def get_checkpoints(session):
+    return {x.season: x for x in session.query(IngestCheckpoints).all()}
+
+def save_checkpoint(session, season, last_match_id, status):
+    query = insert(IngestCheckpoints).values(season=season,
+        last_match_id=last_match_id, status=status, updated_at=func.now())
+    query = query.on_conflict_do_update(constraint='ingest_checkpoints_pkey',
+        set_={col: getattr(query.excluded, col)
+            for col in ['last_match_id', 'status', 'updated_at']})
+    session.execute(query)
+
+def ingest_season(season, start_id, end_id, matches,
+        chunk_size=DEFAULT_CHUNK_SIZE, checkpoint=True):
+    # Load matches with IDs from start_id to end_id (pairs of match ID and
+    # MatchBatch, as from fetch_matches) chunk_size at a time, committing
+    # each chunk along with the season's checkpoint so at most one chunk is
+    # held in memory or lost on failure. The season's ladder and player
+    # totals are calculated at the end
+    def load_chunk(batch, last_match_id):
         with Session(engine) as session:
-            query = insert(Matches).values(match_stats)\
-                .on_conflict_do_nothing()
-            session.execute(query)
-            query = insert(PlayersBySeason).values(player_season_stats)\
-                .on_conflict_do_nothing()
-            session.execute(query)
+            if len(batch):
+                batch.matches['live'] = [int(x) != 100
+                    for x in batch.matches['percent_complete']]
+                load_batch(session, batch)
+            if checkpoint:
+                save_checkpoint(session, season, last_match_id, 'in_progress')
             session.commit()
-            query = insert(PlayerStats).values(player_stats)\
-                .on_conflict_do_nothing()
-            session.execute(query)
+    batch = MatchBatch()
+    last_match_id = None
+    num_matches = 0
+    for match_id, match_batch in matches:
+        last_match_id = match_id
+        if match_batch is not None:
+            batch.extend(match_batch)
+            num_matches += 1
+        if match_id % 10 == 0:
+            print(f'{season}: Data for match with ID {match_id} obtained'
+                f' ({match_id - start_id} / {end_id - start_id})')
+        if len(batch) >= chunk_size:
+            load_chunk(batch, last_match_id)
+            batch = MatchBatch()
+    if last_match_id is not None:
+        load_chunk(batch, last_match_id)
+    with Session(engine) as session:
+        calculate_ladder(session, season, latest_round=True)
+        update_player_season_stats(session, season)
+        rebuild_leaders(session, season)
+        if checkpoint:
+            save_checkpoint(session, season, end_id, 'complete')
+        notify_cache_invalidation(session, 'all')
+        session.commit()
+    return num_matches
+
+@click.command()
+@click.option('--max_workers', default=DEFAULT_MAX_WORKERS, type=click.INT)
+@click.option('--retries', default=DEFAULT_RETRIES, type=click.INT)
+@click.option('--backoff_factor', default=DEFAULT_BACKOFF_FACTOR, type=click.FLOAT)
+@click.option('--rebuild_season_stats', is_flag=True,
+    help='Only rebuild player_season_stats from player_stats and exit')
+@click.option('--rebuild_leaders', 'rebuild_leaders_only', is_flag=True,
+    help='Only rebuild the leaderboards of each season (or those given) and exit')
+@click.option('--rebuild_analytics', is_flag=True,
+    help='Only rebuild the stat store behind the percentile endpoints and exit')
+@click.option('--archive_dir', default=None,
+    help='Directory of the raw XML archive (default XML_ARCHIVE_DIR or xml_archive)')
+@click.option('--no_archive', is_flag=True, help='Do not archive fetched XML')
+@click.option('--replay', is_flag=True,
+    help='Ingest matches from the XML archive rather than fetching them'
+        ' (checkpoints are not used)')
+@click.option('--season', 'seasons', multiple=True, type=click.INT,
+    help='Only ingest this season (can be repeated)')
+@click.option('--start_id', default=None, type=click.INT,
+    help='Only ingest matches from this ID (checkpoints are not used)')
+@click.option('--end_id', default=None, type=click.INT,
+    help='Only ingest matches up to this ID (checkpoints are not used)')
+@click.option('--chunk_size', default=DEFAULT_CHUNK_SIZE, type=click.INT,
+    help='Number of matches committed at a time')
+@click.option('--restart', is_flag=True,
+    help='Ingest seasons from their start, ignoring checkpoints')
+@click.option('--status', is_flag=True, help='Only print checkpoints and exit')
+def main(max_workers, retries, backoff_factor, rebuild_season_stats,
+        rebuild_leaders_only, rebuild_analytics, archive_dir, no_archive, replay, seasons, start_id,
+        end_id, chunk_size, restart, status):
+    if rebuild_season_stats:
+        with Session(engine) as session:
+            update_player_season_stats(session)
+            notify_cache_invalidation(session, 'all')
             session.commit()
-            calculate_ladder(session, season, latest_round=True)
+        print('Player season stats rebuilt')
+        return
+    if rebuild_leaders_only:
+        with Session(engine) as session:
+            for season in seasons or SEASON_MATCH_IDS:
+                rebuild_leaders(session, season)
+                print(f'{season}: Leaderboards rebuilt')
+            notify_cache_invalidation(session, 'all')
             session.commit()
-        print(f'{season}: Values upserted for matches with IDs {start_id} to {end_id}')
+        return
+    if rebuild_analytics:
+        with Session(engine) as session:
+            version = build_stat_cube(session)
+        print(f'Stat store rebuilt as version {version}')
+        return
+    with Session(engine) as session:
+        checkpoints = get_checkpoints(session)
+    if status:
+        for season in SEASON_MATCH_IDS:
+            if season in checkpoints:
+                x = checkpoints[season]
+                print(f'{season}: {x.status} up to match with ID'
+                    f' {x.last_match_id} ({x.updated_at})')
+            else:
+                print(f'{season}: not started')
+        return
+    # Checkpoints track whole seasons fetched from DTLive, so are not used for
+    # a range of IDs or when replaying (which re-ingests finished seasons)
+    use_checkpoints = start_id is None and end_id is None and not replay
+    http = create_http_session(max_workers, retries, backoff_factor)
+    archive = None if no_archive and not replay else XmlArchive(archive_dir)
+    for season in SEASON_MATCH_IDS:
+        if seasons and season not in seasons:
+            continue
+        season_start_id, season_end_id = SEASON_MATCH_IDS[season]
+        # Restrict to the given range of IDs, if any
+        season_start_id = max(season_start_id, start_id or season_start_id)
+        season_end_id = min(season_end_id, end_id or season_end_id)
+        checkpoint = checkpoints.get(season)
+        if use_checkpoints and checkpoint is not None and not restart:
+            if checkpoint.status == 'complete':
+                print(f'{season}: Already ingested (use --restart to ingest again)')
+                continue
+            print(f'{season}: Resuming after match with ID {checkpoint.last_match_id}')
+            season_start_id = max(season_start_id, checkpoint.last_match_id + 1)
+        elif season_start_id > season_end_id:
+            continue
+        # Empty if every match of a resumed season was loaded, in which case
+        # only the ladder and player totals are calculated
+        match_ids = range(season_start_id, season_end_id + 1)
+        if replay:
+            matches = replay_matches(archive, match_ids)
+        else:
+            matches = fetch_matches(match_ids, max_workers, http, archive)
+        num_matches = ingest_season(season, season_start_id, season_end_id,
+            matches, chunk_size, use_checkpoints)
+        print(f'{season}: Values upserted for {num_matches} matches with IDs'
+            f' {season_start_id} to {season_end_id}')
     with Session(engine) as session:
-        sql = text('REFRESH MATERIALIZED VIEW player_season_stats;')
-        session.execute(sql)
         # Fix a player entered with different names
         query = update(PlayersBySeason)\
             .where(PlayersBySeason.team == 'Richmond', PlayersBySeason.name == 'D.Smith')\
             .values(name='D.Eggmolesse-Smith')
         session.execute(query)
-        session.commit()
\ No newline at end of file
+        notify_cache_invalidation(session, 'all')
+        session.commit()
+        # API processes map the new build on their next analytics request
+        version = build_stat_cube(session)
+        print(f'Stat store rebuilt as version {version}')
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,71 @@
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, desc, text
+from sqlalchemy import create_engine, desc, text, update
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import pytz
 import time
 import os
 import requests
 import json
+import hashlib
 import click
 
 from api.schema import *
 from api.api import *
-from ingest_historical import get_match_data, calculate_ladder
+from api.cache import notify_cache_invalidation
+from api.analytics import build_stat_cube
+from ingest_historical import calculate_ladder, \
+    update_player_season_stats, fetch_match_xml, parse_match_data, \
+    update_round_leaders, update_season_leaders
+from archive import XmlArchive
 
 load_dotenv()
 engine = create_engine(os.getenv('DATABASE_URI'))
 # TODO: Update this if running for during season with a different final home
 # and away round
 LAST_HNA_ROUND = 24
+# Channel on which match changes are announced when publishing with NOTIFY
+MATCH_UPDATES_CHANNEL = 'match_updates'
+# Seconds between polls of each live match: most often near the end of a
+# quarter or when the margin is close late in a match, and least often before
+# a match starts or once it has finished
+FAST_POLL_SECONDS = 5
+POLL_SECONDS = 15
+SLOW_POLL_SECONDS = 60
+MIN_SLEEP_SECONDS = 1
+# Quarters last 20 minutes plus time on, counted up by the match clock
+QUARTER_END_MINUTES = 18
+CLOSE_MARGIN = 12
+
+def poll_interval(match_stats):
+    percent_complete = int(match_stats['percent_complete'] or 0)
+    if percent_complete == 0 or percent_complete == 100:
+        return SLOW_POLL_SECONDS
+    try:
+        minutes = int(str(match_stats['time']).split(':')[0])
+    except ValueError:
+        minutes = 0
+    if minutes >= QUARTER_END_MINUTES or percent_complete % 25 >= 22:
+        return FAST_POLL_SECONDS
+    margin = abs(6 * int(match_stats['home_goals'] or 0)
+        + int(match_stats['home_behinds'] or 0)
+        - 6 * int(match_stats['away_goals'] or 0)
+        - int(match_stats['away_behinds'] or 0))
+    if percent_complete >= 75 and margin <= CLOSE_MARGIN:
+        return FAST_POLL_SECONDS
+    return POLL_SECONDS
 
 class LiveScheduler:
-    def __init__(self, sleep_seconds, inactive_per_hour):
+    def __init__(self, sleep_seconds, inactive_per_hour, publish='http',
+            archive=None):
         self.sleep_seconds = sleep_seconds
         self.inactive_per_hour = inactive_per_hour
+        self.publish = publish
+        # Every distinct version of each live match's XML is archived
+        self.archive = archive
         with Session(engine) as session:
             earliest_live_id = session.query(Matches.id)\
                 .where(Matches.live == True)\
@@ -38,17 +80,29 @@ class LiveScheduler:
         self.match_schema = MatchesWithPlayerStatsSchema()
         self.players_by_season_schema = PlayerSchema()
         self.player_stats_schema = PlayerStatsSchema()
+        # Last seen state of each live match, used to skip fetching, writing
+        # and broadcasting anything which has not changed since the last poll,
+        # and when it is next due to be polled
+        self.match_states = {}
+        # Candidate live matches are polled, written and published concurrently
+        self.executor = ThreadPoolExecutor(3)
+        # The ladder, season totals and leaderboards are shared between
+        # matches, so are updated by one thread at a time
+        self.aggregates_lock = threading.Lock()
+        # Stat store rebuilds take a while, so are serialised separately
+        self.stat_cube_lock = threading.Lock()
 
     def start(self):
         if self.sleep_seconds:
             while True:
                 self.job()
-                time.sleep(self.sleep_seconds)
+                time.sleep(self.next_sleep_seconds())
         else:
             self.job()
     
     def job(self):
-        # In inactive mode, only run in PM AET hours and (by default) every fifth minute
+        # In inactive mode, only run in PM AET hours and (by default) every
+        # minute, so a new match is picked up soon after it starts
         if self.active:
             self.active_job()
             return
@@ -62,59 +116,216 @@ class LiveScheduler:
             return
         self.inactive_job()
 
-    def active_job(self):
-        print(f'{datetime.now()}: beginning active job')
-        # Query the given match and the next two (no more than three matches
-        # are ever concurrently active)
-        possible_live_ids = range(self.earliest_live_id, self.earliest_live_id + 3)
+    def poll_match(self, match_id):
+        # Fetch a match using a conditional request where the server supports
+        # it, falling back to comparing a hash of the content. Returns the
+        # parsed match data, which is the cached data if nothing has changed
+        state = self.match_states.setdefault(match_id, {
+            'etag': None,
+            'last_modified': None,
+            'digest': None,
+            'match_data': None,
+            'match_stats': None,
+            'player_stats': {},
+            'player_ids': set(),
+            'published': False,
+        })
+        headers = {}
+        if state['match_data'] is not None:
+            if state['etag']:
+                headers['If-None-Match'] = state['etag']
+            if state['last_modified']:
+                headers['If-Modified-Since'] = state['last_modified']
+        response = fetch_match_xml(match_id, headers=headers)
+        if response.status_code == 304:
+            return state['match_data']
+        state['etag'] = response.headers.get('ETag')
+        state['last_modified'] = response.headers.get('Last-Modified')
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest != state['digest']:
+            state['digest'] = digest
+            state['match_data'] = parse_match_data(match_id, response.content)
+            if self.archive is not None:
+                self.archive.put(match_id, response.content,
+                    state['match_data'][0]['season'])
+        return state['match_data']
+
+    def bump_version(self, session, match_id, changed_player_ids=None):
+        # Increment the match's version and, when publishing with NOTIFY,
+        # announce the change to listeners (i.e. the websocket server) when
+        # the transaction commits. Listeners read the changed rows themselves
+        version = session.execute(update(Matches)\
+            .where(Matches.id == match_id)\
+            .values(version=Matches.version + 1)\
+            .returning(Matches.version)).scalar_one()
+        if self.publish != 'notify':
+            return
+        payload = {'id': match_id, 'version': version}
+        if changed_player_ids is not None:
+            payload['player_ids'] = sorted(int(x) for x in changed_player_ids)
+        session.execute(text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': MATCH_UPDATES_CHANNEL, 'payload': json.dumps(payload)})
+
+    def post_message(self, message):
+        return requests.post(os.getenv('WEBSOCKET_HTTP_URI'),
+            headers={'Authorization': f'Bearer {os.getenv("WEBSOCKET_SECRET")}'},
+            data=json.dumps(message))
+
+    def publish_match(self, session, match_id, changed_player_ids=None):
+        # Once the websocket server has a snapshot of a match, only send it the
+        # player stats which have changed; it works out the delta to send to
+        # clients. The full match is sent again if the server has lost it
+        new_match_stats = query_match_with_player_stats(session, match_id)
+        match = self.match_schema.dump(new_match_stats)
+        state = self.match_states.get(match_id)
+        if state and state.get('published') and changed_player_ids is not None:
+            response = self.post_message({
+                'type': 'update',
+                'match': {k: v for k, v in match.items() if k != 'player_stats'},
+                'player_stats': [x for x in match['player_stats']
+                    if str(x['player_id']) in changed_player_ids],
+            })
+            if response.status_code != 409:
+                return
+        response = self.post_message({'type': 'snapshot', 'match': match})
+        if state is not None and response.ok:
+            state['published'] = True
+
+    def process_match(self, match_id, earliest_live_id):
+        # Poll a match and write and publish any changes. Returns None if
+        # there is no match with the ID, otherwise whether it ended and the
+        # timings of each step (in seconds from the start of the poll)
+        start = time.perf_counter()
+        try:
+            match_stats, player_stats, player_season_stats = \
+                self.poll_match(match_id)
+            print(f'Match with ID {match_id} found')
+        except requests.HTTPError:
+            print(f'No match found with ID {match_id}')
+            return None
+        except requests.RequestException as e:
+            # Polled again on the next tick, without affecting other matches
+            print(f'Failed to poll match with ID {match_id}: {e}')
+            return {'ended': False, 'timings': {}}
+        timings = {'fetched': time.perf_counter() - start}
+        state = self.match_states[match_id]
+        state['next_poll'] = time.monotonic() + poll_interval(match_stats)
+        # If percent complete has reached 100, mark the next match as the
+        # current earliest match
         match_ended = False
-        no_live_matches = True
-        for match_id in possible_live_ids:
-            try:
-                match_stats, player_stats, player_season_stats = \
-                    get_match_data(match_id)
-                print(f'Match with ID {match_id} found')
-            except requests.HTTPError:
-                print(f'No match found with ID {match_id}')
-                continue
-            # If percent complete has reached 100, mark the next match as the
-            # current earliest match
-            no_live_matches = False
-            match_stats['live'] = True
-            if match_id == self.earliest_live_id and \
-                    int(match_stats['percent_complete']) == 100:
-                match_ended = True
-                match_stats['live'] = False
-                self.earliest_live_id += 1
-            with Session(engine) as session:
+        match_stats['live'] = True
+        if match_id == earliest_live_id and \
+                int(match_stats['percent_complete']) == 100:
+            match_ended = True
+            match_stats['live'] = False
+        # Only write the match and player rows which differ from those
+        # last written
+        match_changed = match_stats != state['match_stats']
+        changed_player_stats = [x for x in player_stats
+            if x != state['player_stats'].get(x['player_id'])]
+        new_players = [x for x in player_season_stats
+            if x['id'] not in state['player_ids']]
+        if not (match_changed or changed_player_stats or new_players):
+            print(f'No changes for live match with ID {match_id}')
+            return {'ended': match_ended, 'timings': timings}
+        with Session(engine) as session:
+            if match_changed:
                 query = insert(Matches).values(match_stats)
                 query = query.on_conflict_do_update(constraint='matches_pkey',
                     set_={col: getattr(query.excluded, col) for col in match_stats})
                 session.execute(query)
-                query = insert(PlayersBySeason).values(player_season_stats)\
+            if new_players:
+                query = insert(PlayersBySeason).values(new_players)\
                     .on_conflict_do_nothing()
                 session.execute(query)
-                session.commit()
-                query = insert(PlayerStats).values(player_stats)
+                notify_cache_invalidation(session, 'players')
+            session.commit()
+            if changed_player_stats:
+                query = insert(PlayerStats).values(changed_player_stats)
                 query = query.on_conflict_do_update(constraint='player_stats_pkey',
-                    set_={col: getattr(query.excluded, col) for col in player_stats[0]})
+                    set_={col: getattr(query.excluded, col)
+                        for col in changed_player_stats[0]})
                 session.execute(query)
-                session.commit()
-                # Notify websocket server of update to each current match
-                new_match_stats = session.query(Matches)\
-                    .where(Matches.id == match_id).one()
-                requests.post(os.getenv('WEBSOCKET_HTTP_URI'),
-                    headers={'Authorization': f'Bearer {os.getenv("WEBSOCKET_SECRET")}'},
-                    data=json.dumps(self.match_schema.dump(new_match_stats)))
-                # Only update ladder and season averages when a match ends and only
-                # update ladder during the home and away season
-                if match_ended:
-                    sql = text('REFRESH MATERIALIZED VIEW player_season_stats;')
-                    session.execute(sql)
+            changed_player_ids = {x['player_id'] for x in changed_player_stats}
+            self.bump_version(session, match_id, changed_player_ids)
+            notify_cache_invalidation(session)
+            session.commit()
+            timings['written'] = time.perf_counter() - start
+            state['match_stats'] = dict(match_stats)
+            state['player_stats'].update(
+                {x['player_id']: dict(x) for x in changed_player_stats})
+            state['player_ids'].update(x['id'] for x in new_players)
+            # Notify websocket server of update to each changed match. With
+            # NOTIFY, the update was announced when the write was committed
+            if self.publish == 'http':
+                self.publish_match(session, match_id, changed_player_ids)
+            timings['published'] = time.perf_counter() - start
+            # Leaderboards are updated after publishing so as not to delay it
+            if changed_player_stats:
+                with self.aggregates_lock:
+                    update_round_leaders(session, int(match_stats['season']),
+                        int(match_stats['round']))
+                    notify_cache_invalidation(session)
+                    session.commit()
+            # Only update ladder and season averages when a match ends and only
+            # update ladder during the home and away season
+            if match_ended:
+                with self.aggregates_lock:
+                    update_player_season_stats(session, int(match_stats['season']),
+                        [int(x['player_id']) for x in player_stats])
+                    update_season_leaders(session, int(match_stats['season']))
                     if int(match_stats['round']) <= LAST_HNA_ROUND:
-                        calculate_ladder(session)
+                        # Only rounds from the finished match's onwards change
+                        calculate_ladder(session,
+                            from_round=int(match_stats['round']))
+                    notify_cache_invalidation(session)
                     session.commit()
-                print(f'Values upserted for live match with ID {match_id}')
+                with self.stat_cube_lock:
+                    build_stat_cube(session)
+            print(f'Values upserted for live match with ID {match_id}')
+        return {'ended': match_ended, 'timings': timings}
+
+    def active_job(self):
+        print(f'{datetime.now()}: beginning active job')
+        tick_start = time.perf_counter()
+        # Forget matches which are no longer live
+        for match_id in list(self.match_states):
+            if match_id < self.earliest_live_id:
+                del self.match_states[match_id]
+        # Query the given match and the next two (no more than three matches
+        # are ever concurrently active), when each is next due to be polled
+        possible_live_ids = range(self.earliest_live_id, self.earliest_live_id + 3)
+        now = time.monotonic()
+        due_ids = [x for x in possible_live_ids
+            if self.match_states.get(x, {}).get('next_poll', 0) <= now]
+        futures = {match_id: self.executor.submit(self.process_match, match_id,
+            self.earliest_live_id) for match_id in due_ids}
+        results = {}
+        for match_id, future in futures.items():
+            try:
+                results[match_id] = future.result()
+            except Exception as e:
+                # e.g. malformed XML or a failed write or publish. Other matches
+                # are unaffected and this one is polled again on the next tick
+                print(f'Failed to process match with ID {match_id}: {e!r}')
+                results[match_id] = {'ended': False, 'timings': {}}
+        # Matches which were not due were live at their last poll
+        no_live_matches = len(due_ids) == len(possible_live_ids) and \
+            all(x is None for x in results.values())
+        if (results.get(self.earliest_live_id) or {}).get('ended'):
+            self.earliest_live_id += 1
+        # Time from the start of the tick's polls until each match's changes
+        # were written and broadcast
+        for match_id, result in results.items():
+            if result is not None and 'published' in result['timings']:
+                timings = result['timings']
+                print(f'Match with ID {match_id}: fetched in'
+                    f' {1000 * timings["fetched"]:.0f} ms, written in'
+                    f' {1000 * (timings["written"] - timings["fetched"]):.0f} ms,'
+                    f' broadcast {1000 * timings["published"]:.0f} ms after polling')
+        print(f'{datetime.now()}: active job polled {len(due_ids)} of'
+            f' {len(possible_live_ids)} matches in'
+            f' {1000 * (time.perf_counter() - tick_start):.0f} ms')
         # If none of the previously live matches are active any more, return to
         # inactive mode
         if no_live_matches:
@@ -122,6 +333,16 @@ class LiveScheduler:
             self.active = False
             print(f'No live matches found; switching to inactive mode')
 
+    def next_sleep_seconds(self):
+        # Sleep until the next match is due to be polled, for no longer than
+        # sleep_seconds
+        next_polls = [x['next_poll'] for x in self.match_states.values()
+            if 'next_poll' in x]
+        if not self.active or not next_polls:
+            return self.sleep_seconds
+        return min(max(min(next_polls) - time.monotonic(), MIN_SLEEP_SECONDS),
+            self.sleep_seconds)
+
     def inactive_job(self):
         print(f'{datetime.now()}: beginning inactive job')
         with Session(engine) as session:
@@ -129,8 +350,10 @@ class LiveScheduler:
                 .order_by(desc(Matches.id))\
                 .limit(1).one()[0] + 1
         try:
+            # Also starts the match's state, so the first active poll only
+            # writes what has changed since
             match_stats, player_stats, player_season_stats = \
-                get_match_data(next_match_id)
+                self.poll_match(next_match_id)
         except requests.HTTPError:
             print(f'No match found with ID {next_match_id}')
             return
@@ -144,26 +367,40 @@ class LiveScheduler:
             query = insert(PlayersBySeason).values(player_season_stats)\
                 .on_conflict_do_nothing()
             session.execute(query)
+            notify_cache_invalidation(session, 'players')
             session.commit()
             query = insert(PlayerStats).values(player_stats)
             session.execute(query)
+            self.bump_version(session, next_match_id)
+            notify_cache_invalidation(session)
             session.commit()
+            state = self.match_states[next_match_id]
+            state['match_stats'] = dict(match_stats)
+            state['player_stats'] = {x['player_id']: dict(x) for x in player_stats}
+            state['player_ids'] = {x['id'] for x in player_season_stats}
+            state['next_poll'] = time.monotonic() + poll_interval(match_stats)
             # Notify websocket server of new match
-            new_match_stats = session.query(Matches)\
-                .where(Matches.id == next_match_id).one()
-            requests.post(os.getenv('WEBSOCKET_HTTP_URI'),
-                headers={'Authorization': f'Bearer {os.getenv("WEBSOCKET_SECRET")}'},
-                data=json.dumps(self.match_schema.dump(new_match_stats)))
+            if self.publish == 'http':
+                self.publish_match(session, next_match_id)
         print(f'Match with ID {next_match_id} found and values upserted; switching to active mode')
         self.earliest_live_id = next_match_id
         self.active = True
 
 @click.command()
-@click.option('--sleep_seconds', default=None, type=click.INT)
-@click.option('--inactive_per_hour', default=12, type=click.INT)
-def main(sleep_seconds, inactive_per_hour):
+@click.option('--sleep_seconds', default=None, type=click.INT,
+    help='Longest time between polls; live matches are polled as often as'
+        ' their state needs')
+@click.option('--inactive_per_hour', default=60, type=click.INT)
+@click.option('--publish', default='http', type=click.Choice(['http', 'notify']),
+    help='Post updates to the websocket server over HTTP, or announce them with'
+        ' NOTIFY for a websocket server listening to the database')
+@click.option('--archive_dir', default=None,
+    help='Directory of the raw XML archive (default XML_ARCHIVE_DIR or xml_archive)')
+@click.option('--no_archive', is_flag=True, help='Do not archive fetched XML')
+def main(sleep_seconds, inactive_per_hour, publish, archive_dir, no_archive):
     # Omit sleep_seconds when running as a cron job
-    schedule = LiveScheduler(sleep_seconds, inactive_per_hour)
+    archive = None if no_archive else XmlArchive(archive_dir)
+    schedule = LiveScheduler(sleep_seconds, inactive_per_hour, publish, archive)
     schedule.start()
 
 if __name__ == '__main__':
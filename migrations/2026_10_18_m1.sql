@@ -0,0 +1,30 @@
+DROP MATERIALIZED VIEW player_season_stats;
+CREATE TABLE player_season_stats (
+    player_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    games INTEGER,
+    kicks INTEGER,
+    handballs INTEGER,
+    marks INTEGER,
+    goals INTEGER,
+    behinds INTEGER,
+    tackles INTEGER,
+    hitouts INTEGER,
+    frees_for INTEGER,
+    frees_against INTEGER,
+    PRIMARY KEY (player_id, season)
+);
+INSERT INTO player_season_stats
+SELECT player_id, season,
+    COUNT(kicks) AS games,
+    SUM(kicks) AS kicks,
+    SUM(handballs) AS handballs,
+    SUM(marks) AS marks,
+    SUM(goals) AS goals,
+    SUM(behinds) AS behinds,
+    SUM(tackles) AS tackles,
+    SUM(hitouts) AS hitouts,
+    SUM(frees_for) AS frees_for,
+    SUM(frees_against) AS frees_against
+FROM player_stats
+GROUP BY player_id, season;
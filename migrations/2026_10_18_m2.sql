@@ -0,0 +1 @@
+ALTER TABLE matches ADD version INTEGER DEFAULT 0;
@@ -0,0 +1 @@
+CREATE INDEX matches_season_round_idx ON matches (season, round);
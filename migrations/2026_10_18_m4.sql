@@ -0,0 +1,16 @@
+-- Indexes for the API's access paths. Run outside a transaction (e.g. with
+-- psql -f) since indexes are built concurrently to avoid blocking ingestion
+CREATE INDEX CONCURRENTLY IF NOT EXISTS player_stats_player_id_match_id_idx
+    ON player_stats (player_id, match_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matches_home_team_id_idx
+    ON matches (home_team, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matches_away_team_id_idx
+    ON matches (away_team, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS players_by_season_season_team_jumper_number_idx
+    ON players_by_season (season, team, jumper_number);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ladder_season_round_idx
+    ON ladder (season, round);
+ANALYZE player_stats;
+ANALYZE matches;
+ANALYZE players_by_season;
+ANALYZE ladder;
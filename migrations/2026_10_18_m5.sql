@@ -0,0 +1,7 @@
+CREATE TABLE ingest_checkpoints (
+    season INTEGER NOT NULL,
+    last_match_id INTEGER,
+    status VARCHAR(20),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (season)
+);
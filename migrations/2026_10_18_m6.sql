@@ -0,0 +1,23 @@
+-- Populate afterwards with python ingest_historical.py --rebuild_leaders
+CREATE TABLE season_leaders (
+    season INTEGER NOT NULL,
+    stat VARCHAR(20) NOT NULL,
+    player_id INTEGER NOT NULL,
+    rank INTEGER,
+    value INTEGER,
+    PRIMARY KEY (season, stat, player_id)
+);
+CREATE INDEX season_leaders_season_stat_rank_idx
+    ON season_leaders (season, stat, rank);
+CREATE TABLE round_leaders (
+    season INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    stat VARCHAR(20) NOT NULL,
+    player_id INTEGER NOT NULL,
+    match_id INTEGER,
+    rank INTEGER,
+    value INTEGER,
+    PRIMARY KEY (season, round, stat, player_id)
+);
+CREATE INDEX round_leaders_season_round_stat_rank_idx
+    ON round_leaders (season, round, stat, rank);
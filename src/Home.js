@@ -18,7 +18,7 @@ import { Refresh, Circle } from '@mui/icons-material';
 import { Link, useSearchParams } from 'react-router-dom';
 import useWebSocket, { ReadyState } from 'react-use-websocket';
 
-import { apiRequester, calculateAverage, getRoundName, formatLiveText } from './helpers.js';
+import { apiRequester, applyLiveMessage, calculateAverage, getRoundName, formatLiveText } from './helpers.js';
 import { WEBSOCKET_URI } from './secrets.js';
 
 const currentMatchesUrl = '/api/current_matches';
@@ -264,30 +264,39 @@ function Home() {
   const { sendJsonMessage, lastJsonMessage, readyState } = useWebSocket(
     WEBSOCKET_URI, {share: false, shouldReconnect: () => true})
 
-  // Run when the connection state (readyState) changes
+  // Run when the connection state (readyState) or displayed round changes, so
+  // that only live updates for matches in the displayed round are received
   // TODO: add retry count
   useEffect(() => {
-    if (readyState === ReadyState.OPEN) {
-      sendJsonMessage({event: 'subscribe'})
+    if (readyState === ReadyState.OPEN && season && (round || round === 0)) {
+      const topics = [`round:${season}/${round}`];
+      sendJsonMessage({event: 'subscribe', topics: topics});
+      return () => sendJsonMessage({event: 'unsubscribe', topics: topics});
     }
-  }, [readyState]);
+  }, [readyState, season, round]);
 
   // Run when a new WebSocket message is received
   useEffect(() => {
-    if (!lastJsonMessage) {
+    if (!lastJsonMessage?.type) {
       return;
     }
     const indexToUpdate = matches.findIndex(x => x.id === lastJsonMessage.id);
     if (indexToUpdate !== -1) {
       // Update an existing match
+      const newMatch = applyLiveMessage(matches[indexToUpdate], lastJsonMessage);
+      if (!newMatch) {
+        sendJsonMessage({event: 'resync', match_id: lastJsonMessage.id});
+        return;
+      }
       const newMatches = [...matches];
-      newMatches[indexToUpdate] = lastJsonMessage;
+      newMatches[indexToUpdate] = newMatch;
       setMatches(newMatches);
       setAnimatedIds([...animatedIds, lastJsonMessage.id]);
-    } else if (lastJsonMessage.season === season &&
-        lastJsonMessage.round === round) {
+    } else if (lastJsonMessage.type === 'snapshot' &&
+        lastJsonMessage.match.season === season &&
+        lastJsonMessage.match.round === round) {
       // Render a new match in the same round
-      setMatches([lastJsonMessage, ...matches]);
+      setMatches([applyLiveMessage(null, lastJsonMessage), ...matches]);
       setAnimatedIds([...animatedIds, lastJsonMessage.id]);
     }
   }, [lastJsonMessage]);
@@ -16,7 +16,7 @@ import { useParams, Link } from 'react-router-dom';
 import useWebSocket, { ReadyState } from 'react-use-websocket';
 import { visuallyHidden } from '@mui/utils';
 
-import { apiRequester, getRoundName, formatLiveText } from './helpers.js';
+import { apiRequester, applyLiveMessage, getRoundName, formatLiveText } from './helpers.js';
 import { WEBSOCKET_URI } from './secrets.js';
 
 function MatchInfo({ match, animatedIds, stopAnimation }) {
@@ -283,17 +283,22 @@ function Match() {
 
   useEffect(() => {
     if (readyState === ReadyState.OPEN) {
-      sendJsonMessage({event: 'subscribe'})
+      sendJsonMessage({event: 'subscribe', topics: [`match:${matchId}`]})
     }
   }, [readyState]);
 
   useEffect(() => {
-    if (!lastJsonMessage) {
+    if (!lastJsonMessage?.type) {
       return;
     }
     if (match && match.id == lastJsonMessage.id) {
       // Update the current match
-      setMatch(lastJsonMessage);
+      const newMatch = applyLiveMessage(match, lastJsonMessage);
+      if (!newMatch) {
+        sendJsonMessage({event: 'resync', match_id: match.id});
+        return;
+      }
+      setMatch(newMatch);
       setAnimatedIds([...animatedIds, lastJsonMessage.id]);
     }
   }, [lastJsonMessage]);
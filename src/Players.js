@@ -31,7 +31,7 @@ import {
 } from 'chart.js';
 import { Line } from 'react-chartjs-2';
 
-import { apiRequester, BaseChartOptions, chartColours } from './helpers.js';
+import { apiRequester, columnsToRows, BaseChartOptions, chartColours } from './helpers.js';
 
 ChartJS.register(
   CategoryScale,
@@ -146,8 +146,20 @@ function Players() {
     if (chartData.map(x => x[0].id).includes(player.id)) {
       setChartData(chartData.filter(x => x[0].id !== player.id));
     } else if (chartData.length < 6) {
-      apiRequester({url: `/api/player/${player.id}`})
-        .then(data => setChartData([...chartData, data]));
+      // Fetch every player on the chart in one request, which is likely to
+      // be cached by the API when the other chart has the same players. Only
+      // season totals are charted, so game logs are left out
+      const playerIds = [...chartData.map(x => x[0].id), player.id];
+      const params = playerIds.map(x => `player_id=${x}`).join('&');
+      apiRequester({url: `/api/compare?${params}&games=false`}).then(data => {
+        if (!data) {
+          return;
+        }
+        const seasons = columnsToRows(data.seasons);
+        setChartData(playerIds
+          .map(id => seasons.filter(x => x.id === id))
+          .filter(x => x.length));
+      });
     }
   }
 
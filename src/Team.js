@@ -13,7 +13,7 @@ import Stack from '@mui/material/Stack';
 import { useParams, Link } from 'react-router-dom';
 import useWebSocket, { ReadyState } from 'react-use-websocket';
 
-import { apiRequester } from './helpers.js';
+import { apiRequester, applyLiveMessage } from './helpers.js';
 import { WEBSOCKET_URI } from './secrets.js';
 import { MatchCard } from './Home.js';
 
@@ -100,19 +100,24 @@ function Team() {
 
   useEffect(() => {
     if (readyState === ReadyState.OPEN) {
-      sendJsonMessage({event: 'subscribe'})
+      sendJsonMessage({event: 'subscribe', topics: [`team:${teamName}`]})
     }
   }, [readyState]);
 
   useEffect(() => {
-    if (!lastJsonMessage) {
+    if (!lastJsonMessage?.type) {
       return;
     }
     const indexToUpdate = matches.findIndex(x => x.id === lastJsonMessage.id);
     if (indexToUpdate !== -1) {
       // Update an existing match
+      const newMatch = applyLiveMessage(matches[indexToUpdate], lastJsonMessage);
+      if (!newMatch) {
+        sendJsonMessage({event: 'resync', match_id: lastJsonMessage.id});
+        return;
+      }
       const newMatches = [...matches];
-      newMatches[indexToUpdate] = lastJsonMessage;
+      newMatches[indexToUpdate] = newMatch;
       setMatches(newMatches);
       setAnimatedIds([...animatedIds, lastJsonMessage.id]);
     }
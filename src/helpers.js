@@ -20,6 +20,35 @@ export const apiRequester = async ({url, method = 'GET', data = null}) => {
   }
 }
 
+// Convert a columnar payload (each field mapped to a list of values) to a list
+// of row objects
+export const columnsToRows = columns => {
+  const fields = Object.keys(columns);
+  const numRows = fields.length ? columns[fields[0]].length : 0;
+  return Array.from({length: numRows}, (_, i) =>
+    Object.fromEntries(fields.map(field => [field, columns[field][i]])));
+}
+
+// Apply a live update from the websocket server to a match. Snapshots replace
+// the match; deltas are merged in and must follow on from the last sequence
+// number seen. Returns null if a delta has been missed, in which case a resync
+// should be requested
+export const applyLiveMessage = (match, message) => {
+  if (message.type === 'snapshot') {
+    return {...message.match, _seq: message.seq};
+  }
+  if (!match || match._seq === undefined || message.seq !== match._seq + 1) {
+    return null;
+  }
+  const newMatch = {...match, ...message.match, _seq: message.seq};
+  if (match.player_stats && message.player_stats.length) {
+    const rows = new Map(match.player_stats.map(x => [x.player_id, x]));
+    message.player_stats.forEach(x => rows.set(x.player_id, {...rows.get(x.player_id), ...x}));
+    newMatch.player_stats = [...rows.values()];
+  }
+  return newMatch;
+}
+
 export const getOrdinal = n => {
   let ord = 'th';
   if (n % 10 == 1 && n % 100 != 11) {
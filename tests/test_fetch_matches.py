@@ -0,0 +1,100 @@
+# Runs the concurrent fetcher in ingest_historical.py against a local stub of
+# DTLive serving the match XML in tests/fixtures/xml (named <match ID>.xml),
+# so no network or database is needed:
+#   python -m pytest tests
+import os
+import socket
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from unittest import mock
+import requests
+
+# The ingest script creates an engine on import but never connects here
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+import ingest_historical
+from ingest_historical import create_http_session, fetch_matches
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures' / 'xml'
+# Always answered with a server error
+FAILING_MATCH_ID = 500
+
+def closed_port_url():
+    # A local URL with nothing listening
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{s.getsockname()[1]}'
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        name = self.path.rsplit('/', 1)[-1]
+        if name == f'{FAILING_MATCH_ID}.xml':
+            self.send_response(500)
+            self.end_headers()
+            return
+        path = FIXTURES_DIR / name
+        if not path.is_file():
+            self.send_response(404)
+            self.end_headers()
+            return
+        content = path.read_bytes()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+class FetchMatchesTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever,
+            daemon=True)
+        self.thread.start()
+        base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.patch = mock.patch.object(ingest_historical, 'BASE_URL', base_url)
+        self.patch.start()
+        self.http = create_http_session(4, retries=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.patch.stop()
+        self.http.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetches_matches_in_order(self):
+        results = list(fetch_matches([1, 2, 3], max_workers=4, http=self.http))
+        self.assertEqual([match_id for match_id, _ in results], [1, 2, 3])
+        # There is no fixture for match 3
+        self.assertIsNone(results[2][1])
+        batch = results[0][1]
+        self.assertEqual(batch.matches['id'], [1])
+        self.assertEqual(batch.matches['away_team'], ['Greater Western Sydney'])
+        self.assertEqual(batch.player_stats['player_id'], ['101', '102', '201', '202'])
+        self.assertEqual(batch.player_stats['position'], ['C', 'RK', 'HBFR', 'INT'])
+        self.assertEqual(batch.player_stats['subbed_on'], [False, False, False, True])
+        self.assertEqual(batch.players['team'],
+            ['Adelaide', 'Adelaide', 'Greater Western Sydney', 'Greater Western Sydney'])
+        self.assertEqual(results[1][1].player_stats['subbed_off'],
+            [False, True, False, False])
+
+    def test_server_errors_are_retried_then_raised(self):
+        with self.assertRaises(requests.HTTPError):
+            list(fetch_matches([1, FAILING_MATCH_ID, 2], max_workers=4,
+                http=self.http))
+        # The first request and two retries
+        self.assertEqual(self.server.requests.count(f'/{FAILING_MATCH_ID}.xml'), 3)
+
+    def test_connection_errors_are_raised(self):
+        with mock.patch.object(ingest_historical, 'BASE_URL', closed_port_url()):
+            with self.assertRaises(requests.ConnectionError):
+                list(fetch_matches([1], max_workers=1, http=self.http))
+
+if __name__ == '__main__':
+    unittest.main()
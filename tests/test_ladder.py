@@ -0,0 +1,59 @@
+# Checks the ladder accumulated by calculate_ladder against totals summed
+# directly over every match up to each round:
+#   python -m pytest tests
+import os
+import unittest
+import pandas as pd
+
+# The ingest script creates an engine on import but never connects here
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from ingest_historical import accumulate_ladder, LADDER_COLUMNS
+
+TEAMS = ['Brisbane', 'Carlton', 'Geelong', 'Sydney']
+# A season with an opening round (numbered 0) and a bye for two teams
+MATCHES = pd.DataFrame([
+    (0, 'Sydney', 'Carlton', 86, 80),
+    (0, 'Brisbane', 'Geelong', 70, 70),
+    (1, 'Carlton', 'Brisbane', 95, 61),
+    (1, 'Geelong', 'Sydney', 77, 102),
+    (2, 'Sydney', 'Brisbane', 64, 88),
+    (3, 'Geelong', 'Carlton', 110, 54),
+    (3, 'Brisbane', 'Sydney', 81, 79),
+], columns=['round', 'home_team', 'away_team', 'home_score', 'away_score'])
+
+def expected_row(team, round):
+    # As the ladder was originally calculated: each team's matches in rounds
+    # up to and including the given one
+    row = dict.fromkeys(LADDER_COLUMNS, 0)
+    for x in MATCHES[MATCHES['round'] <= round].itertuples():
+        if team == x.home_team:
+            points_for, points_against = x.home_score, x.away_score
+        elif team == x.away_team:
+            points_for, points_against = x.away_score, x.home_score
+        else:
+            continue
+        row['points_for'] += points_for
+        row['points_against'] += points_against
+        row['wins'] += points_for > points_against
+        row['losses'] += points_for < points_against
+        row['draws'] += points_for == points_against
+    return row
+
+class AccumulateLadderTest(unittest.TestCase):
+    def test_matches_direct_totals(self):
+        last_round = MATCHES['round'].max()
+        ladder = accumulate_ladder(MATCHES, TEAMS, last_round)
+        self.assertEqual(len(ladder), len(TEAMS) * last_round)
+        for row in ladder.to_dict('records'):
+            self.assertEqual({col: row[col] for col in LADDER_COLUMNS},
+                expected_row(row['team'], row['round']), (row['team'], row['round']))
+
+    def test_opening_round_counted_in_round_one(self):
+        ladder = accumulate_ladder(MATCHES, TEAMS, 1).set_index(['team', 'round'])
+        self.assertEqual(ladder.loc[('Sydney', 1), 'wins'], 2)
+        self.assertEqual(ladder.loc[('Brisbane', 1), 'draws'], 1)
+        self.assertEqual(ladder.loc[('Carlton', 1), 'points_for'], 175)
+
+if __name__ == '__main__':
+    unittest.main()
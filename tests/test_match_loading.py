@@ -0,0 +1,59 @@
+# Checks that loading and serialising a match for /api/match/<id> takes a
+# fixed number of queries however many players it has, against an in-memory
+# SQLite database so no server is needed:
+#   python -m pytest tests
+import os
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+# The API creates an engine on import but this test uses its own
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from api.schema import Base, Teams, Matches, PlayersBySeason, PlayerStats
+from api.api import MatchesWithPlayerStatsSchema, query_match_with_player_stats
+from benchmarks.match_loading import QueryCounter, MAX_QUERIES
+
+PLAYERS_PER_SIDE = 22
+
+class MatchLoadingTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine, tables=[Teams.__table__,
+            Matches.__table__, PlayersBySeason.__table__, PlayerStats.__table__])
+        with Session(self.engine) as session:
+            session.add_all([Teams(name='Adelaide', nickname='Crows'),
+                Teams(name='Brisbane', nickname='Lions')])
+            session.add(Matches(id=1, round=1, season=2024, location='Adelaide Oval',
+                home_team='Adelaide', away_team='Brisbane', home_goals=10,
+                home_behinds=8, away_goals=9, away_behinds=12, live=False,
+                time='Full Time', percent_complete=100))
+            for i in range(2 * PLAYERS_PER_SIDE):
+                session.add(PlayersBySeason(id=i + 1, season=2024,
+                    name=f'Player {i + 1}',
+                    team='Adelaide' if i < PLAYERS_PER_SIDE else 'Brisbane',
+                    jumper_number=i % PLAYERS_PER_SIDE + 1))
+            session.flush()
+            for i in range(2 * PLAYERS_PER_SIDE):
+                session.add(PlayerStats(match_id=1, season=2024, player_id=i + 1,
+                    position='C', kicks=i, handballs=i, marks=1, goals=0,
+                    behinds=0, tackles=2, hitouts=0, frees_for=1,
+                    frees_against=0, subbed_on=False, subbed_off=False))
+            session.commit()
+        self.counter = QueryCounter()
+        event.listen(self.engine, 'before_cursor_execute', self.counter)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.counter)
+        self.engine.dispose()
+
+    def test_match_query_count(self):
+        with Session(self.engine) as session:
+            match = query_match_with_player_stats(session, 1)
+            result = MatchesWithPlayerStatsSchema().dump(match)
+        self.assertEqual(len(result['player_stats']), 2 * PLAYERS_PER_SIDE)
+        self.assertTrue(all(x['player']['name'] for x in result['player_stats']))
+        self.assertLessEqual(self.counter.count, MAX_QUERIES)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,16 @@
 import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from tornado.web import Application, RequestHandler
-from tornado.websocket import WebSocketHandler
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
 from tornado.escape import json_decode
+from json import JSONDecodeError
+import json
 from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import os
 import logging
 
@@ -15,34 +23,352 @@ ALLOWED_WS_ORIGINS = [
     'https://footycharts.com.au',
 ]
 
+# Maximum number of messages waiting to be sent to a client before its queued
+# updates are coalesced into a snapshot, and then before it is disconnected
+MAX_QUEUE_DEPTH = int(os.getenv('WEBSOCKET_MAX_QUEUE_DEPTH', 16))
+# Enables permessage-deflate, trading server CPU for bandwidth
+COMPRESSION = os.getenv('WEBSOCKET_COMPRESSION') == 'true'
+# Enables listening for match changes announced by the live ingester with
+# NOTIFY (ingest_live.py --publish notify), alongside accepting POSTs
+LISTEN = os.getenv('WEBSOCKET_LISTEN') == 'true'
+MATCH_UPDATES_CHANNEL = 'match_updates'
+
 logger = logging.getLogger(__name__)
 
+def diff_dict(old, new):
+    return {k: v for k, v in new.items() if k not in old or old[k] != v}
+
+# Latest state of each live match. Clients are sent a snapshot of a match when
+# they subscribe (or request a resync), then only deltas of what has changed.
+# Each delta has a per-match sequence number so clients can detect gaps
+class MatchState:
+    def __init__(self, match):
+        self.id = match['id']
+        self.seq = 1
+        self.match = {k: v for k, v in match.items() if k != 'player_stats'}
+        self.player_stats = {x['player_id']: x
+            for x in match.get('player_stats', [])}
+
+    def topics(self):
+        return [
+            ALL_TOPIC,
+            f'match:{self.id}',
+            f'team:{self.match.get("home_team")}',
+            f'team:{self.match.get("away_team")}',
+            f'round:{self.match.get("season")}/{self.match.get("round")}',
+        ]
+
+    def snapshot(self):
+        return {
+            'type': 'snapshot',
+            'id': self.id,
+            'seq': self.seq,
+            'match': {**self.match, 'player_stats': list(self.player_stats.values())},
+        }
+
+    def apply(self, match, player_stats):
+        # Merge an update into the state, returning a delta message containing
+        # only the changed fields, or None if nothing changed
+        match_delta = diff_dict(self.match, match)
+        player_stats_delta = []
+        for row in player_stats:
+            old_row = self.player_stats.get(row['player_id'])
+            if old_row is None:
+                player_stats_delta.append(row)
+                self.player_stats[row['player_id']] = row
+                continue
+            row_delta = diff_dict(old_row, row)
+            if row_delta:
+                player_stats_delta.append({'player_id': row['player_id'], **row_delta})
+                old_row.update(row_delta)
+        self.match.update(match_delta)
+        if not match_delta and not player_stats_delta:
+            return None
+        self.seq += 1
+        return {
+            'type': 'delta',
+            'id': self.id,
+            'seq': self.seq,
+            'match': match_delta,
+            'player_stats': player_stats_delta,
+        }
+
+MATCHES = {}
+def update_match(message):
+    # Returns the state of the match for an update posted by the live
+    # ingester, along with the message to broadcast (None if there is nothing
+    # to send). A full snapshot is required for matches without a known state
+    if message.get('type') == 'update':
+        match = message['match']
+        player_stats = message.get('player_stats', [])
+    else:
+        # Full match, either as a snapshot message or a bare serialised match
+        match = message.get('match', message)
+        player_stats = match.get('player_stats', [])
+        match = {k: v for k, v in match.items() if k != 'player_stats'}
+    match_state = MATCHES.get(match['id'])
+    if match_state is None:
+        if message.get('type') == 'update':
+            raise KeyError(match['id'])
+        match_state = MatchState({**match, 'player_stats': player_stats})
+        broadcast = match_state.snapshot()
+    else:
+        broadcast = match_state.apply(match, player_stats)
+    # Finished matches need no further deltas
+    if match_state.match.get('live') is False:
+        MATCHES.pop(match_state.id, None)
+    else:
+        MATCHES[match_state.id] = match_state
+    return match_state, broadcast
+
+# A message to be sent to many clients, encoded to JSON only once. Messages
+# about a match can be replaced by a snapshot of the match for slow clients
+class Broadcast:
+    def __init__(self, message, match_state=None):
+        self.message = message
+        self.match_state = match_state
+
+    @cached_property
+    def text(self):
+        if isinstance(self.message, str):
+            return self.message
+        return json.dumps(self.message)
+
+    @cached_property
+    def snapshot(self):
+        return Broadcast(self.match_state.snapshot(), self.match_state)
+
+# Clients subscribe to topics for a single match (match:<id>), a team's
+# matches (team:<name>), a round's matches (round:<season>/<round>) or all
+# matches (*), and are only sent messages for those topics
+ALL_TOPIC = '*'
 CLIENTS = set()
+TOPICS = defaultdict(set)
 class SocketHandler(WebSocketHandler):
     @classmethod
-    def send_message(cls, message: str):
-        logger.info(f'Sending message to clients {CLIENTS}')
-        for client in CLIENTS:
-            client.write_message(message)
+    def send_message(cls, message, topics=(ALL_TOPIC,), match_state=None):
+        clients = set().union(*[TOPICS.get(topic, ()) for topic in topics])
+        logger.info(f'Sending message to {len(clients)} clients')
+        broadcast = Broadcast(message, match_state)
+        for client in clients:
+            client.enqueue(broadcast)
     
     def initialize(self):
-        pass
+        self.topics = set()
+        self.queue = deque()
+        self.queue_event = asyncio.Event()
+        self.sender = None
     
     def open(self):
         logger.info(f'Opening connection with client {self}')
         CLIENTS.add(self)
-        self.write_message('Connected')
+        self.sender = asyncio.create_task(self.send_queued())
+        self.enqueue(Broadcast('Connected'))
+
+    def enqueue(self, broadcast):
+        if len(self.queue) >= MAX_QUEUE_DEPTH and broadcast.match_state:
+            # Replace the match's queued (and now out of date) messages with
+            # its latest snapshot
+            match_id = broadcast.match_state.id
+            self.queue = deque(x for x in self.queue if x.match_state is None
+                or x.match_state.id != match_id)
+            broadcast = broadcast.snapshot
+        if len(self.queue) >= MAX_QUEUE_DEPTH:
+            logger.info(f'Disconnecting slow client {self}')
+            self.close()
+            return
+        self.queue.append(broadcast)
+        self.queue_event.set()
+
+    async def send_queued(self):
+        while True:
+            await self.queue_event.wait()
+            while self.queue:
+                broadcast = self.queue.popleft()
+                try:
+                    await self.write_message(broadcast.text)
+                except WebSocketClosedError:
+                    return
+            self.queue_event.clear()
+
+    def subscribe(self, topics):
+        new_topics = set(topics) - self.topics
+        for topic in new_topics:
+            TOPICS[topic].add(self)
+        self.topics.update(new_topics)
+        # Bring clients joining mid-match up to date
+        for match_state in MATCHES.values():
+            if new_topics.intersection(match_state.topics()):
+                self.enqueue(Broadcast(match_state.snapshot(), match_state))
+
+    def unsubscribe(self, topics):
+        for topic in self.topics.intersection(topics):
+            TOPICS[topic].discard(self)
+            if not TOPICS[topic]:
+                del TOPICS[topic]
+        self.topics.difference_update(topics)
     
     def on_message(self, message):
         logger.info(f'Message received from client {self}: {message}')
+        try:
+            message = json_decode(message)
+        except JSONDecodeError:
+            return
+        if not isinstance(message, dict):
+            return
+        topics = message.get('topics')
+        if topics is not None and not (isinstance(topics, list) and
+                all(isinstance(x, str) for x in topics)):
+            return
+        if message.get('event') == 'subscribe':
+            # Subscribe to all matches if no topics are given
+            self.subscribe(topics or [ALL_TOPIC])
+        elif message.get('event') == 'unsubscribe':
+            self.unsubscribe(topics or list(self.topics))
+        elif message.get('event') == 'resync':
+            match_state = MATCHES.get(message.get('match_id'))
+            if match_state:
+                self.enqueue(Broadcast(match_state.snapshot(), match_state))
     
     def on_close(self):
         logger.info(f'Closing connection with client {self}')
         CLIENTS.remove(self)
+        self.unsubscribe(list(self.topics))
+        if self.sender:
+            self.sender.cancel()
     
     def check_origin(self, origin):
         return origin in ALLOWED_WS_ORIGINS
+
+    def get_compression_options(self):
+        return {} if COMPRESSION else None
     
+def publish_update(message):
+    # Raises KeyError if a partial update is given for an unknown match
+    match_state, broadcast = update_match(message)
+    if broadcast:
+        SocketHandler.send_message(broadcast, match_state.topics(), match_state)
+
+def database_dsn():
+    # DATABASE_URI is a SQLAlchemy URL, which may specify the driver
+    return os.getenv('DATABASE_URI').replace('postgresql+psycopg2://', 'postgresql://')
+
+# Reads changed matches from the database for NOTIFY-based updates, in the
+# same shape as MatchesWithPlayerStatsSchema. Reads run on a single worker
+# thread with its own connection so the event loop is never blocked
+class MatchReader:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.connection = None
+
+    def read(self, match_id, player_ids=None):
+        if self.connection is None or self.connection.closed:
+            self.connection = psycopg2.connect(database_dsn())
+            self.connection.autocommit = True
+        with self.connection.cursor(
+                cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute('''
+                SELECT *,
+                    6 * home_goals + home_behinds AS home_score,
+                    6 * away_goals + away_behinds AS away_score
+                FROM matches
+                WHERE id = %(match_id)s
+            ''', {'match_id': match_id})
+            match = cursor.fetchone()
+            if match is None:
+                return None
+            sql = '''
+                SELECT ps.*, pbs.name, pbs.team, pbs.jumper_number
+                FROM player_stats ps
+                JOIN players_by_season pbs
+                ON pbs.id = ps.player_id AND pbs.season = ps.season
+                WHERE ps.match_id = %(match_id)s
+            '''
+            if player_ids is not None:
+                sql += ' AND ps.player_id = ANY(%(player_ids)s)'
+            cursor.execute(sql, {'match_id': match_id, 'player_ids': player_ids})
+            player_stats = []
+            for row in cursor.fetchall():
+                player = {
+                    'id': row['player_id'],
+                    'season': row['season'],
+                    'name': row.pop('name'),
+                    'team': row.pop('team'),
+                    'jumper_number': row.pop('jumper_number'),
+                }
+                player_stats.append({**row, 'player': player})
+        return dict(match), player_stats
+
+    async def read_async(self, match_id, player_ids=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.read, match_id,
+            player_ids)
+
+async def handle_notification(reader, payload, versions):
+    payload = json.loads(payload)
+    match_id = payload['id']
+    version = payload['version']
+    last_version = versions.get(match_id)
+    if last_version is not None and version <= last_version:
+        return
+    # Read only the changed player stats, unless a notification has been
+    # missed or the match is not yet known
+    player_ids = payload.get('player_ids')
+    if last_version is None or version != last_version + 1 or \
+            match_id not in MATCHES:
+        player_ids = None
+    versions[match_id] = version
+    result = await reader.read_async(match_id, player_ids)
+    if result is None:
+        return
+    match, player_stats = result
+    if player_ids is None:
+        publish_update({'type': 'snapshot',
+            'match': {**match, 'player_stats': player_stats}})
+    else:
+        publish_update({'type': 'update', 'match': match,
+            'player_stats': player_stats})
+
+async def listen_for_updates():
+    # Hold a LISTEN connection to the database, reconnecting if it is lost
+    reader = MatchReader()
+    versions = {}
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            connection = psycopg2.connect(database_dsn())
+            connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {MATCH_UPDATES_CHANNEL};')
+            logger.info(f'Listening for notifications on {MATCH_UPDATES_CHANNEL}')
+            notifications = asyncio.Queue()
+            def on_readable():
+                try:
+                    connection.poll()
+                except psycopg2.Error:
+                    notifications.put_nowait(None)
+                    return
+                while connection.notifies:
+                    notifications.put_nowait(connection.notifies.pop(0).payload)
+            loop.add_reader(connection.fileno(), on_readable)
+            try:
+                while (payload := await notifications.get()) is not None:
+                    try:
+                        await handle_notification(reader, payload, versions)
+                    except Exception:
+                        logger.exception('Failed to handle notification')
+            finally:
+                loop.remove_reader(connection.fileno())
+                connection.close()
+            logger.info('Lost LISTEN connection; reconnecting')
+        except psycopg2.Error:
+            logger.exception('Failed to LISTEN for notifications')
+        # Any notifications sent while disconnected are missed, so read the
+        # full matches next time
+        versions.clear()
+        await asyncio.sleep(5)
+
 class HttpHandler(RequestHandler):
     def get(self):
         logger.info(f'GET request received from IP {self.request.remote_ip},'
@@ -57,7 +383,13 @@ class HttpHandler(RequestHandler):
             self.write('401 Unauthorized')
             return
         message = json_decode(self.request.body)
-        SocketHandler.send_message(message)
+        try:
+            publish_update(message)
+        except KeyError:
+            # Ask the live ingester to send the full match
+            self.set_status(409)
+            self.write('409 Conflict')
+            return
         self.write('200 OK')
 
 async def main():
@@ -68,6 +400,8 @@ async def main():
         (r'/ws', SocketHandler),
     ])
     app.listen(7000)
+    if LISTEN:
+        await listen_for_updates()
     await asyncio.Event().wait()
 
 if __name__ == '__main__':